@@ -0,0 +1,31 @@
+import swagger
+
+from tornado.web import RequestHandler
+from tornado.escape import json_encode
+
+from admin.manager import IndexManager
+from commons import Loggable
+from util import error
+
+
+class IndexStatsHandler(RequestHandler, Loggable):
+
+  def initialize(self):
+    self.__index_mgr = IndexManager()
+
+  @swagger.operation
+  async def get(self):
+    """
+    Get usage statistics of the database indexes
+    ---
+    responses:
+      200:
+        description: index usage per collection
+        content:
+          application/json:
+            schema:
+              type: object
+    """
+    status, stats, err = await self.__index_mgr.get_index_stats()
+    self.set_status(status)
+    self.write(json_encode(stats if status == 200 else error(err)))
@@ -0,0 +1,51 @@
+from tornado.gen import multi
+
+from config import config
+from commons import MongoClient, Manager
+from appliance.manager import ApplianceDBManager
+from container.manager import ContainerDBManager, EventStreamDBManager
+from volume.manager import VolumeDBManager
+from cluster.manager import AgentDBManager, MasterDBManager
+from schedule.local import ScheduleQueueDBManager
+
+
+class IndexManager(Manager):
+
+  COLLECTIONS = ('appliance', 'container', 'volume', 'agent', 'master', 'schedule_queue',
+                 'leader', 'event_stream', )
+
+  def __init__(self):
+    self.__db = MongoClient()[config.db.name]
+    self.__db_mgrs = [ApplianceDBManager(), ContainerDBManager(), VolumeDBManager(),
+                      AgentDBManager(), MasterDBManager(), ScheduleQueueDBManager(),
+                      EventStreamDBManager()]
+
+  async def ensure_indexes(self):
+    """
+    Creates the indexes of all the collections if they do not exist yet. Failures, e.g.,
+    duplicate documents violating a unique index, are logged without stopping the others.
+
+    """
+    for mgr, exc in zip(self.__db_mgrs,
+                        await multi([self._ensure_indexes(mgr) for mgr in self.__db_mgrs])):
+      if exc:
+        self.logger.error('Failed to create indexes for %s: %s'%(mgr.__class__.__name__, exc))
+    self.logger.info('Indexes are ensured')
+
+  async def get_index_stats(self):
+    """
+    Reports the usage of the indexes of each collection since the database server started
+
+    """
+    stats = {}
+    for col in self.COLLECTIONS:
+      stats[col] = [dict(name=s['name'], key=dict(s['key']),
+                         ops=s['accesses']['ops'], since=s['accesses']['since'].isoformat())
+                    async for s in self.__db[col].aggregate([{'$indexStats': {}}])]
+    return 200, stats, None
+
+  async def _ensure_indexes(self, mgr):
+    try:
+      await mgr.ensure_indexes()
+    except Exception as e:
+      return str(e)
@@ -106,7 +106,7 @@ class ApplianceHandler(RequestHandler, Loggable):
       400:
         description: unrecognized parameter value(s)
         content:
-          application/json
+          application/json:
             schema: Error
       404:
         description: The requested appliance does not exist
@@ -4,9 +4,10 @@ import schedule
 import volume
 
 from tornado.gen import multi
+from pymongo import IndexModel
 
 from config import config
-from commons import MongoClient, AutonomousMonitor
+from commons import MongoClient, AutonomousMonitor, TTLCache
 from commons import Manager, APIManager
 from appliance import Appliance
 from container.manager import ContainerManager
@@ -21,23 +22,41 @@ class ApplianceManager(Manager):
     self.__contr_mgr = ContainerManager()
     self.__app_db = ApplianceDBManager()
     self.__vol_mgr = VolumeManager()
+    self.__app_cache = TTLCache(config.cache.appliance_size, config.cache.appliance_ttl)
 
   async def get_appliance(self, app_id):
-    status, app, err = await self.__app_db.get_appliance(app_id)
+    """
+    Read-through: appliances are served from the per-process cache until they expire or
+    get invalidated by changes of the appliance, its containers or its volumes. The cached
+    appliances are shared, hence callers must copy them before making any changes.
+
+    """
+    app = self.__app_cache.get(app_id)
+    if app:
+      return 200, app, None
+    status, app, err = await self._load_appliance(app_id)
     if status != 200:
       return status, app, err
-    app = Appliance(**app)
-    status, app.containers, err = await self.__contr_mgr.get_containers(appliance=app_id)
-    if app.data_persistence:
-      _, local_vols, _ = await self.__vol_mgr.get_local_volumes(appliance=app_id)
-      _, global_vols, _ = await self.__vol_mgr.get_global_volumes_by_appliance(app_id)
-      app.data_persistence.volumes = local_vols + global_vols
     if len(app.containers) == 0 \
         and (not app.data_persistence or len(app.data_persistence.volumes) == 0):
       await self.__app_db.delete_appliance(app_id)
+      self.invalidate_appliance(app_id)
       return 404, None, "Appliance '%s' is not found"%app_id
+    self.__app_cache.put(app_id, app)
     return 200, app, None
 
+  async def hydrate_appliance(self, app_id):
+    """
+    Builds the appliance from the database only: neither the states of its containers nor
+    the deployments of its volumes are refreshed from upstream. Meant for callers that only
+    need the appliance metadata, e.g., to provision one of its containers.
+
+    """
+    app = self.__app_cache.get(app_id)
+    if app:
+      return 200, app, None
+    return await self._load_appliance(app_id, refresh=False)
+
   async def create_appliance(self, data):
 
     vol_mgr = self.__vol_mgr
@@ -50,10 +69,9 @@ class ApplianceManager(Manager):
     async def update_global_volumes(global_vols, app_id):
       for gpv in global_vols:
         gpv.subscribe(app_id)
-      resps = await multi([vol_mgr.update_volume(gpv) for gpv in global_vols])
-      for status, _, err in resps:
-        if status != 200:
-          self.logger.error(err)
+      status, _, err = await vol_mgr.update_volumes(global_vols)
+      if status != 200:
+        self.logger.error(err)
 
     def set_container_volume_scope(contrs, vols):
       vols = {v.id: v for v in vols}
@@ -109,9 +127,9 @@ class ApplianceManager(Manager):
       self.logger.error(err)
       await self._clean_up_incomplete_appliance(app.id)
       return status, None, err
-    scheduler = self._get_scheduler(app.scheduler)
+    scheduler = self.get_scheduler(app.scheduler)
     self.logger.info('Appliance %s uses %s'%(app.id, scheduler.__class__.__name__))
-    ApplianceScheduleExecutor(app.id, scheduler).start()
+    await ApplianceScheduleExecutor().submit(app.id, scheduler)
     return 201, app, None
 
   async def delete_appliance(self, app_id, purge_data=False):
@@ -122,6 +140,7 @@ class ApplianceManager(Manager):
       self.logger.error(err)
       return status, None, err
     self.logger.info("Stop monitoring appliance '%s'"%app_id)
+    self.invalidate_appliance(app_id)
 
     # deprovision containers
     status, msg, err = await self.__contr_mgr.delete_containers(appliance=app_id)
@@ -144,9 +163,9 @@ class ApplianceManager(Manager):
         _, global_vols, _ = await vol_mgr.get_global_volumes_by_appliance(app_id)
         for gpv in global_vols:
           gpv.unsubscribe(app_id)
-        for status, _, err in (await multi([vol_mgr.update_volume(gpv) for gpv in global_vols])):
-          if status != 200:
-            self.logger.error(err)
+        status, _, err = await vol_mgr.update_volumes(global_vols)
+        if status != 200:
+          self.logger.error(err)
 
     # deprovision appliance
     status, msg, err = await self.__app_api.deprovision_appliance(app_id)
@@ -155,13 +174,33 @@ class ApplianceManager(Manager):
       return 207, None, "Failed to deprovision appliance '%s'"%app_id
     if purge_data:
       await self.__app_db.delete_appliance(app_id)
+    self.invalidate_appliance(app_id)
     ApplianceDeletionChecker(app_id).start()
     return status, msg, None
 
   async def save_appliance(self, app, upsert=True):
+    self.invalidate_appliance(app.id)
     return await self.__app_db.save_appliance(app, upsert)
 
-  def _get_scheduler(self, sched):
+  def invalidate_appliance(self, app_id):
+    self.__app_cache.invalidate(app_id)
+
+  async def _load_appliance(self, app_id, refresh=True):
+    status, app, err = await self.__app_db.get_appliance(app_id)
+    if status != 200:
+      return status, app, err
+    app = Appliance(**app)
+    _, app.containers, _ = await self.__contr_mgr.get_containers(refresh=refresh,
+                                                                 appliance=app_id)
+    if app.data_persistence:
+      _, local_vols, _ = await self.__vol_mgr.get_local_volumes(refresh=refresh,
+                                                                appliance=app_id)
+      _, global_vols, _ = await self.__vol_mgr.get_global_volumes_by_appliance(app_id,
+                                                                               refresh=refresh)
+      app.data_persistence.volumes = local_vols + global_vols
+    return 200, app, None
+
+  def get_scheduler(self, sched):
     try:
       sched_mod = '.'.join(sched.name.split('.')[:-1])
       sched_class = sched.name.split('.')[-1]
@@ -173,6 +212,7 @@ class ApplianceManager(Manager):
   async def _clean_up_incomplete_appliance(self, app_id):
     await self.__app_db.delete_appliance(app_id)
     await self.__contr_mgr.delete_containers(appliance=app_id)
+    self.invalidate_appliance(app_id)
 
 
 class ApplianceAPIManager(APIManager):
@@ -199,6 +239,9 @@ class ApplianceDBManager(Manager):
   def __init__(self):
     self.__app_col = MongoClient()[config.db.name].appliance
 
+  async def ensure_indexes(self):
+    await self.__app_col.create_indexes([IndexModel('id', unique=True)])
+
   async def get_appliances(self, **filters):
     return 200, [Appliance(**app) async for app in self.__app_col.find(filters)], None
 
@@ -232,7 +275,7 @@ class ApplianceDeletionChecker(AutonomousMonitor):
       self.logger.info("Appliance '%s' still exists, deleting"%self.__app_id)
       await self.__app_api.deprovision_appliance(self.__app_id)
       return
-    _, contrs, _ = await self.__contr_mgr.get_containers(appliance=self.__app_id)
+    _, contrs, _ = await self.__contr_mgr.get_container_summaries(appliance=self.__app_id)
     if contrs:
       self.logger.info("Found obsolete container(s) of appliance '%s', deleting"%self.__app_id)
       await self.__contr_mgr.delete_containers(appliance=self.__app_id)
@@ -0,0 +1,124 @@
+"""
+Placement time of the bin-packing global schedulers, against a pure Python best fit
+
+Usage: python benchmarks/bench_bin_packing.py
+
+"""
+import sys
+import time
+import random
+
+from os.path import abspath, dirname
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+# imported in the same order as by the server, as the managers import each other
+import appliance.manager
+
+from container import Container
+from container.service import Service
+from cluster import Agent, AgentResources
+from schedule.plugin.universal.bin_packing import BinPackingGlobalScheduler
+from schedule.plugin.universal.bin_packing import DominantResourceGlobalScheduler
+
+
+def make_agents(n):
+  return [Agent('a%d'%i, 'h%d'%i,
+                AgentResources(random.choice([8, 16, 32, 64]),
+                               random.choice([16384, 65536, 262144]), 10**6,
+                               random.choice([0, 0, 0, 4]), ['1-1000']),
+                dict(cloud='aws', region='r%d'%(i%4), zone='z%d'%(i%12),
+                     preemptible=random.choice(['true', 'false'])))
+          for i in range(n)]
+
+
+def make_containers(n):
+  contrs = []
+  for i in range(n):
+    type = random.choice(['job', 'service'])
+    data = dict(id='c%d'%i, appliance='app', type=type, image='x',
+                resources=dict(cpus=random.choice([1, 2, 4]), mem=random.choice([1024, 4096, 8192]),
+                               disk=0, gpu=random.choice([0, 0, 0, 1]) if type == 'service' else 0),
+                schedule_hints=dict(preemptible=random.random() < .3))
+    if type == 'service':
+      data['instances'] = random.choice([1, 2])
+    _, contr, _ = Container.parse(data)
+    contrs.append(contr)
+  return contrs
+
+
+def get_demand(contr):
+  r, n = contr.resources, contr.instances if isinstance(contr, Service) else 1
+  return [r.cpus * n, r.mem * n, r.disk * n, r.gpu * n]
+
+
+def check(agents, contrs):
+  """
+  Checks that no agent is overcommitted and the `preemptible` hints are honored
+
+  :return: int, the number of containers placed
+
+  """
+  free = {a.hostname: [a.resources.cpus, a.resources.mem, a.resources.disk, a.resources.gpus]
+          for a in agents}
+  preemptible = {a.hostname: a.attributes['preemptible'] for a in agents}
+  n_placed = 0
+  for c in contrs:
+    host = c.sys_schedule_hints.placement.host
+    if not host:
+      continue
+    n_placed += 1
+    free[host] = [f - d for f, d in zip(free[host], get_demand(c))]
+    assert preemptible[host] == str(c.sys_schedule_hints.preemptible).lower()
+  assert all(f >= 0 for res in free.values() for f in res)
+  return n_placed
+
+
+def place_in_python(contrs, agents):
+  free = {a.hostname: [a.resources.cpus, a.resources.mem, a.resources.disk, a.resources.gpus]
+          for a in agents}
+  preemptible = {a.hostname: a.attributes['preemptible'] for a in agents}
+  scale = [max(res[i] for res in free.values()) or 1 for i in range(4)]
+  for c in contrs:
+    demand, pre = get_demand(c), str(c.user_schedule_hints.preemptible).lower()
+    best = None
+    for host, res in free.items():
+      if preemptible[host] != pre or any(f < d for f, d in zip(res, demand)):
+        continue
+      score = sum((f - d)/s for f, d, s in zip(res, demand, scale))
+      if best is None or score < best[0]:
+        best = score, host
+    if best:
+      free[best[1]] = [f - d for f, d in zip(free[best[1]], demand)]
+
+
+def time_placement(scheduler, contrs, agents, n_runs=5):
+  elapsed = []
+  for _ in range(n_runs):
+    for c in contrs:
+      c.sys_schedule_hints = c.user_schedule_hints
+    start = time.perf_counter()
+    n_placed = scheduler.place(contrs, agents)
+    elapsed += time.perf_counter() - start,
+  assert check(agents, contrs) == n_placed
+  return min(elapsed), n_placed
+
+
+def main():
+  random.seed(0)
+  for cls in (BinPackingGlobalScheduler, DominantResourceGlobalScheduler):
+    for n_agents, n_contrs in ((1000, 100), (5000, 300), (5000, 1000)):
+      agents, contrs = make_agents(n_agents), make_containers(n_contrs)
+      elapsed, n_placed = time_placement(cls(), contrs, agents)
+      print('%s, agents: %d, containers: %d, placed: %d, %.1f ms'%(cls.__name__, n_agents,
+                                                                   n_contrs, n_placed,
+                                                                   elapsed * 1000))
+  agents, contrs = make_agents(5000), make_containers(300)
+  start = time.perf_counter()
+  place_in_python(contrs, agents)
+  print('pure Python best fit, agents: 5000, containers: 300, %.1f ms'
+        %((time.perf_counter() - start) * 1000))
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,143 @@
+"""
+Memory footprint and attribute access time of the container, agent and volume models,
+against a baseline of the same models without `__slots__` whose getters copy the
+collections they return, i.e., the models as they were before being slotted
+
+Usage: python benchmarks/bench_models.py [n_containers] [n_agents] [n_volumes]
+
+"""
+import ast
+import sys
+import json
+import time
+import inspect
+import importlib
+import tracemalloc
+
+from os.path import abspath, dirname
+from types import ModuleType, MappingProxyType
+
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+# imported in the same order as by the server, as the managers import each other
+import appliance.manager
+
+# in dependency order, so that the subclasses derive from the baseline of their bases
+MODEL_MODULES = ('cluster', 'volume', 'container', 'container.service', 'container.job', )
+
+
+class SlotsRemover(ast.NodeTransformer):
+
+  def visit_Assign(self, node):
+    if any(isinstance(t, ast.Name) and t.id == '__slots__' for t in node.targets):
+      return None
+    return node
+
+
+def copy_on_read(fget):
+  def get(self):
+    val = fget(self)
+    if isinstance(val, (tuple, frozenset)):
+      return list(val)
+    if isinstance(val, MappingProxyType):
+      return dict(val)
+    return val
+  return get
+
+
+def load_baseline():
+  """
+  Loads the model modules anew from their source, without `__slots__` and with getters
+  that return copies of the tuples, frozensets and read-only mappings they hold
+
+  :return: dict of module names to the baseline modules
+
+  """
+  modules, saved = {}, load_slotted()
+  try:
+    for name in MODEL_MODULES:
+      real = saved[name]
+      tree = ast.fix_missing_locations(SlotsRemover().visit(ast.parse(inspect.getsource(real))))
+      mod = ModuleType(name)
+      mod.__dict__.update(__file__=real.__file__, __package__=real.__package__)
+      if hasattr(real, '__path__'):
+        mod.__path__ = real.__path__
+      # the modules loaded later import the baseline ones
+      sys.modules[name] = modules[name] = mod
+      exec(compile(tree, real.__file__, 'exec'), mod.__dict__)
+      for cls in [v for v in vars(mod).values()
+                  if isinstance(v, type) and v.__module__ == name]:
+        for attr, val in list(vars(cls).items()):
+          if isinstance(val, property) and val.fget:
+            setattr(cls, attr, property(copy_on_read(val.fget), val.fset, val.fdel))
+  finally:
+    sys.modules.update(saved)
+  return modules
+
+
+def load_slotted():
+  return {name: importlib.import_module(name) for name in MODEL_MODULES}
+
+
+def make_service(i):
+  return dict(id='svc-%d'%i, appliance='app-%d'%(i//100), type='service', image='nginx',
+              resources=dict(cpus=1, mem=512), args=['--a', str(i)], env=dict(A='1', B='2'),
+              ports=[dict(container_port=80)],
+              endpoints=[dict(host='h', container_port=80, host_port=3000 + i)],
+              dependencies=['x'], state='running', instances=2)
+
+
+def make_job(i):
+  return dict(id='job-%d'%i, appliance='app-%d'%(i//100), type='job', image='busybox',
+              resources=dict(cpus=1, mem=256), cmd='echo hi', env=dict(A='1'), state='success')
+
+
+def run(modules, n_contrs, n_agents, n_vols, n_passes):
+  cluster, volume = modules['cluster'], modules['volume']
+  Service, Job = modules['container.service'].Service, modules['container.job'].Job
+  tracemalloc.start()
+  start = time.perf_counter()
+  contrs = [Service(**make_service(i)) if i%2 else Job(**make_job(i)) for i in range(n_contrs)]
+  agents = [cluster.Agent('a%d'%i, 'h%d'%i,
+                          cluster.AgentResources(8, 16384, 100000, 0,
+                                                 ['1000-2000', '3000-4000', '5000-32000']),
+                          dict(cloud='c', region='r%d'%(i%4), zone='z%d'%(i%16),
+                               public_ip='1.2.3.%d'%(i%255)))
+            for i in range(n_agents)]
+  vols = [volume.GlobalPersistentVolume(id='v%d'%i, type='cephfs', used_by=['app-1'])
+          for i in range(n_vols)]
+  build = time.perf_counter() - start
+  mem, _ = tracemalloc.get_traced_memory()
+  tracemalloc.stop()
+
+  start = time.perf_counter()
+  for _ in range(n_passes):
+    for c in contrs:
+      len(c.args), len(c.env), len(c.endpoints), len(c.ports), len(c.dependencies)
+    for a in agents:
+      len(a.attributes), len(a.resources.port_ranges)
+      a.resources.check_port_availability(3500)
+  access = time.perf_counter() - start
+
+  start = time.perf_counter()
+  json.dumps([c.to_save() for c in contrs] + [a.to_save() for a in agents]
+             + [v.to_save() for v in vols])
+  save = time.perf_counter() - start
+  return mem/2**20, build, access, save
+
+
+def main(n_contrs=10000, n_agents=1000, n_vols=1000, n_passes=20):
+  baseline = run(load_baseline(), n_contrs, n_agents, n_vols, n_passes)
+  slotted = run(load_slotted(), n_contrs, n_agents, n_vols, n_passes)
+  print('containers: %d, agents: %d, volumes: %d'%(n_contrs, n_agents, n_vols))
+  print('%-36s %10s %10s %8s'%('', 'baseline', 'slotted', 'change'))
+  for label, unit, before, after in zip(('memory', 'construction',
+                                         'attribute accesses, %d passes'%n_passes,
+                                         'to_save and JSON encoding'),
+                                        ('MB', 's', 's', 's'), baseline, slotted):
+    print('%-36s %7.2f %-2s %7.2f %-2s %+7.0f%%'%(label, before, unit, after, unit,
+                                               (after/before - 1) * 100))
+
+
+if __name__ == '__main__':
+  main(*[int(a) for a in sys.argv[1:]])
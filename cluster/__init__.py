@@ -2,6 +2,8 @@ import bisect
 
 import swagger
 
+from types import MappingProxyType
+
 
 @swagger.model
 class Master:
@@ -54,11 +56,13 @@ class Agent:
 
   """
 
+  __slots__ = ('__id', '__hostname', '__resources', '__attributes', )
+
   def __init__(self, id, hostname, resources, attributes={}, *args, **kwargs):
     self.__id = id
     self.__hostname = hostname
     self.__resources = resources
-    self.__attributes = dict(attributes)
+    self.__attributes = MappingProxyType(dict(attributes))
 
   @property
   @swagger.property
@@ -113,11 +117,22 @@ class Agent:
     example:
       region: us-east1
     """
-    return dict(self.__attributes)
+    return self.__attributes
+
+  @property
+  def digest(self):
+    """
+    Content hash over the hostname, resources and attributes of the agent, which changes
+    whenever the agent needs to be rewritten
+
+    """
+    r = self.resources
+    return hash((self.hostname, r.cpus, r.mem, r.disk, r.gpus, r.port_ranges,
+                 tuple(sorted(self.__attributes.items()))))
 
   def to_render(self):
     return dict(id=self.id, hostname=self.hostname,
-                attributes=self.attributes, resources=self.resources.to_render())
+                attributes=dict(self.attributes), resources=self.resources.to_render())
 
   def to_save(self):
     return self.to_render()
@@ -130,12 +145,15 @@ class AgentResources:
 
   """
 
+  __slots__ = ('__cpus', '__mem', '__disk', '__gpus', '__port_ranges', '__port_starts', )
+
   def __init__(self, cpus, mem, disk, gpus, port_ranges):
     self.__cpus = cpus
     self.__mem = mem
     self.__disk = disk
     self.__gpus = gpus
-    self.__port_ranges = [tuple(map(int, p.split('-'))) for p in port_ranges]
+    self.__port_ranges = tuple(tuple(map(int, p.split('-'))) for p in port_ranges)
+    self.__port_starts = tuple(p[0] for p in self.__port_ranges)
 
   @property
   @swagger.property
@@ -208,11 +226,11 @@ class AgentResources:
       - 8182-32000
 
     """
-    return list(self.__port_ranges)
+    return self.__port_ranges
 
   def check_port_availability(self, p):
     assert isinstance(p, int)
-    starts = [p[0] for p in self.port_ranges]
+    starts = self.__port_starts
     idx = bisect.bisect(starts, p, 0, len(starts))
     if idx == 0:
       return False
@@ -227,5 +245,176 @@ class AgentResources:
     return self.to_render()
 
 
+class ClusterSnapshot:
+  """
+  Immutable view of the agents in the cluster at a point in time, indexed by agent ID,
+  hostname and attribute values (e.g., region, zone, cloud, public_ip and fqdn)
+
+  """
+
+  def __init__(self, agents=[]):
+    self.__agents = tuple(agents)
+    self.__by_id = {a.id: a for a in self.__agents}
+    self.__by_hostname = {a.hostname: a for a in self.__agents}
+    by_attr = {}
+    for a in self.__agents:
+      for k, v in a.attributes.items():
+        by_attr.setdefault(k, {}).setdefault(v, []).append(a)
+    self.__by_attribute = {k: {v: tuple(agents) for v, agents in vals.items()}
+                           for k, vals in by_attr.items()}
+
+  @property
+  def agents(self):
+    return self.__agents
+
+  def get_agent(self, agent_id):
+    return self.__by_id.get(agent_id)
+
+  def get_agent_by_hostname(self, hostname):
+    return self.__by_hostname.get(hostname)
+
+  def find_agents(self, **kwargs):
+    """
+    Looks up agents with the same filter semantics as `AgentDBManager.find_agents`: `id`
+    and `hostname` match the agent fields, any other key matches the agent attribute of the
+    same name, and a list value matches any of its elements
+
+    :return: list of cluster.Agent
+
+    """
+    matched = None
+    for k, v in kwargs.items():
+      vals = v if isinstance(v, list) else [v]
+      if k in ('id', 'hostname'):
+        index = self.__by_id if k == 'id' else self.__by_hostname
+        agents = set(index[val] for val in vals if val in index)
+      else:
+        index = self.__by_attribute.get(k, {})
+        agents = set(a for val in vals for a in index.get(val, ()))
+      matched = agents if matched is None else matched & agents
+    return [a for a in self.__agents if matched is None or a in matched]
+
+
+class LocalityTree:
+  """
+  Free resources of the agents aggregated along their locality, i.e., cloud, region, zone
+  and host, as given by the agent attributes. Each node of the tree is identified by the
+  path of attribute values from the root, and is additionally kept in a list sorted by its
+  free CPUs per locality level, so that the nodes short of CPUs are skipped by bisection
+  instead of grouping all the agents.
+
+  The tree is updated incrementally: updating or removing an agent only touches the nodes
+  along its path.
+
+  """
+
+  LEVELS = ('cloud', 'region', 'zone', 'host', )
+  RESOURCES = ('cpus', 'mem', 'disk', 'gpus', )
+
+  def __init__(self, agents=[]):
+    self.__agents = {}
+    self.__nodes = {}
+    self.__levels = {l: [] for l in self.LEVELS}
+    for a in agents:
+      self.update(a)
+
+  def __len__(self):
+    return len(self.__agents)
+
+  def update(self, agent):
+    """
+    Adds the agent, or replaces its previous resources if it is already in the tree
+
+    :param agent: cluster.Agent
+
+    """
+    self.remove(agent.id)
+    r = agent.resources
+    path = tuple(str(agent.attributes.get(l) or '') for l in self.LEVELS)
+    res = (r.cpus, r.mem, r.disk, r.gpus)
+    self.__agents[agent.id] = path, res
+    self._apply(path, res, 1)
+
+  def remove(self, agent_id):
+    """
+
+    :param agent_id: str
+
+    """
+    path, res = self.__agents.pop(agent_id, (None, None))
+    if path:
+      self._apply(path, tuple(-v for v in res), -1)
+
+  def sync(self, agents):
+    """
+    Brings the tree in line with `agents` by updating only the agents whose resources or
+    locality have changed and removing the departed ones
+
+    :param agents: list of cluster.Agent
+
+    """
+    ids = set()
+    for a in agents:
+      ids.add(a.id)
+      r = a.resources
+      path = tuple(str(a.attributes.get(l) or '') for l in self.LEVELS)
+      if self.__agents.get(a.id) != (path, (r.cpus, r.mem, r.disk, r.gpus)):
+        self.update(a)
+    for agent_id in self.__agents.keys() - ids:
+      self.remove(agent_id)
+
+  def find(self, level, **demand):
+    """
+    Finds the node with the most free CPUs among those at `level` having at least the
+    demanded amount of every resource. The nodes with enough CPUs are found by bisection,
+    and then checked for the other resources from the most free CPUs down, hence the query
+    is linear in the number of nodes at the level if most of them lack memory, disk or
+    GPUs.
+
+    :param level: str, one of `LEVELS`
+    :param demand: demanded amounts of `RESOURCES`, e.g., cpus=2, mem=1024
+    :return: tuple of the locality value of the node and its free resources as a dict, or
+             None if no node at the level can accommodate the demand
+
+    """
+    demand = tuple(demand.get(r, 0) for r in self.RESOURCES)
+    nodes = self.__levels[level]
+    lo = bisect.bisect_left(nodes, (demand[0], ))
+    for i in range(len(nodes) - 1, lo - 1, -1):
+      path = nodes[i][1]
+      if not path[-1]:
+        continue
+      res, _ = self.__nodes[path]
+      if all(avail >= d for avail, d in zip(res, demand)):
+        return path[-1], dict(zip(self.RESOURCES, res))
+    return None
+
+  def get_capacity(self, level=None):
+    """
 
+    :param level: str, one of `LEVELS`, or None for the whole cluster
+    :return: list of the nodes at the level, each with its locality, free resources and
+             number of agents
 
+    """
+    if not level:
+      total = [sum(res[i] for _, res in self.__agents.values())
+               for i in range(len(self.RESOURCES))]
+      return [dict(zip(self.RESOURCES, total), agents=len(self.__agents))]
+    return [dict(zip(self.LEVELS, path), **dict(zip(self.RESOURCES, self.__nodes[path][0])),
+                 agents=self.__nodes[path][1])
+            for path in sorted(path for _, path in self.__levels[level])]
+
+  def _apply(self, path, res, count):
+    for depth, level in enumerate(self.LEVELS):
+      key = path[:depth + 1]
+      nodes = self.__levels[level]
+      prev_res, prev_count = self.__nodes.get(key, ((0, ) * len(res), 0))
+      if prev_count:
+        del nodes[bisect.bisect_left(nodes, (prev_res[0], key))]
+      new_res, new_count = tuple(p + v for p, v in zip(prev_res, res)), prev_count + count
+      if new_count:
+        self.__nodes[key] = new_res, new_count
+        bisect.insort(nodes, (new_res[0], key))
+      else:
+        self.__nodes.pop(key, None)
@@ -4,7 +4,9 @@ import swagger
 from tornado.web import RequestHandler
 
 from cluster.manager import ClusterManager
+from cluster import LocalityTree
 from commons import Loggable
+from util import error
 
 
 class ClusterInfoHandler(RequestHandler, Loggable):
@@ -47,3 +49,45 @@ class ClusterInfoHandler(RequestHandler, Loggable):
     else:
       agents = await self.__cluster_mgr.get_cluster()
       self.write(json.dumps([h.to_render() for h in agents]))
+
+
+class ClusterCapacityHandler(RequestHandler, Loggable):
+
+  def initialize(self):
+    self.__cluster_mgr = ClusterManager()
+
+  @swagger.operation
+  async def get(self):
+    """
+    Get free resources in the cluster aggregated by locality
+    ---
+    parameters:
+      - name: level
+        description: locality level to aggregate by, i.e., cloud, region, zone or host. The
+                     whole cluster is aggregated if not given
+        in: query
+        type: str
+        example: region
+    responses:
+      200:
+        description: free CPUs, memory, disk and GPUs, as well as the number of agents, at
+                     each locality of the requested level
+        content:
+          application/json:
+            schema:
+              type: list
+              items: object
+      400:
+        description: unrecognized locality level
+        content:
+          application/json:
+            schema: Error
+    """
+    level = self.get_query_argument('level', None)
+    if level and level not in LocalityTree.LEVELS:
+      self.set_status(400)
+      self.write(json.dumps(error("Unrecognized locality level '%s', expected one of %s"
+                                  %(level, list(LocalityTree.LEVELS)))))
+      return
+    tree = await self.__cluster_mgr.get_locality_tree()
+    self.write(json.dumps(tree.get_capacity(level)))
@@ -1,11 +1,18 @@
+import os
+import json
+import mmap
+import time
+import struct
 import datetime
 
-from tornado.gen import multi
+from functools import partial
+from pymongo import ReplaceOne, IndexModel
+from tornado.ioloop import IOLoop
 
 from config import config
-from cluster import Master, Agent, AgentResources
-from commons import MongoClient, AutonomousMonitor
-from commons import APIManager, Manager
+from cluster import Master, Agent, AgentResources, ClusterSnapshot, LocalityTree
+from commons import MongoClient, AutonomousMonitor, HTTPStream
+from commons import APIManager, Manager, Loggable
 
 
 class ClusterManager(Manager):
@@ -13,23 +20,89 @@ class ClusterManager(Manager):
   def __init__(self, monitor_interval=30000):
     cluster_api, agent_db = ClusterAPIManager(), AgentDBManager()
     self.__cluster_api, self.__agent_db = cluster_api, agent_db
-    self.__cluster_monitor = ClusterMonitor(monitor_interval)
+    if config.mesos.monitor == 'stream':
+      self.__cluster_monitor = ClusterStreamMonitor(monitor_interval)
+    else:
+      self.__cluster_monitor = ClusterMonitor(monitor_interval)
+    self.__is_monitoring, self.__monitor_interval = False, monitor_interval
+    self.__snapshot_file = ClusterSnapshotFile()
+    self.__db_snapshot, self.__db_last_update = None, None
+    self.__locality_tree, self.__tree_snapshot = LocalityTree(), None
 
   async def get_cluster(self, ttl=30):
-    if self._is_cache_expired(ttl):
-      await self.__cluster_monitor.update()
-    return await self.__agent_db.get_all_agents()
+    return list((await self.get_snapshot(ttl)).agents)
 
   async def find_agents(self, ttl=30, **kwargs):
+    return (await self.get_snapshot(ttl)).find_agents(**kwargs)
+
+  async def get_snapshot(self, ttl=None):
+    """
+    Gets the in-process snapshot of the cluster, which is swapped on every monitor update.
+    The agents are loaded from the database only if the monitor has not yet succeeded, and
+    kept for `ttl` seconds or, if it is not given, for a monitor interval.
+
+    Processes that do not run the monitor, i.e., are not the leader, never query Mesos.
+    They read the snapshot file published by the leader, and reload the agents written by
+    the leader from the database only if there is no fresh snapshot file, e.g., on other
+    hosts than the leader's.
+
+    :return: cluster.ClusterSnapshot
+
+    """
+    if not self.__is_monitoring:
+      snapshot = self.__snapshot_file.load()
+      if snapshot:
+        return snapshot
+      return await self._get_db_snapshot(ttl)
     if self._is_cache_expired(ttl):
       await self.__cluster_monitor.update()
-    return await self.__agent_db.find_agents(**kwargs)
+    snapshot = self.__cluster_monitor.snapshot
+    if not snapshot:
+      snapshot = await self._get_db_snapshot(ttl)
+    return snapshot
+
+  async def get_locality_tree(self, ttl=30):
+    """
+    Gets the free resources of the cluster aggregated by locality. The monitor keeps its
+    tree up to date on every update, whereas other processes sync theirs with the agents
+    that have changed whenever a new snapshot is read.
+
+    :return: cluster.LocalityTree
+
+    """
+    snapshot = await self.get_snapshot(ttl)
+    if self.__is_monitoring and snapshot is self.__cluster_monitor.snapshot:
+      return self.__cluster_monitor.locality_tree
+    if snapshot is not self.__tree_snapshot:
+      self.__locality_tree.sync(snapshot.agents)
+      self.__tree_snapshot = snapshot
+    return self.__locality_tree
 
   def start_monitor(self):
+    self.__is_monitoring = True
     self.__cluster_monitor.start()
 
-  def _is_cache_expired(self, ttl):
+  def stop_monitor(self):
+    self.__is_monitoring = False
+    self.__cluster_monitor.stop()
+
+  def invalidate_chronos(self):
+    self.__cluster_monitor.invalidate_chronos()
+
+  async def _get_db_snapshot(self, ttl):
     if ttl is None:
+      # the leader writes the agents to the database at most once per monitor interval
+      ttl = self.__monitor_interval/1000
+    now = datetime.datetime.now(tz=None)
+    if self.__db_snapshot and now - self.__db_last_update <= datetime.timedelta(seconds=ttl):
+      return self.__db_snapshot
+    await self.__cluster_monitor.discover_chronos()
+    self.__db_snapshot = ClusterSnapshot(await self.__agent_db.get_all_agents())
+    self.__db_last_update = now
+    return self.__db_snapshot
+
+  def _is_cache_expired(self, ttl):
+    if ttl is None or self.__cluster_monitor.is_live:
       return False
     if not self.__cluster_monitor.last_update:
       return True
@@ -45,28 +118,86 @@ class ClusterMonitor(AutonomousMonitor):
     self.__master_db = MasterDBManager()
     self.__agent_db = AgentDBManager()
     self.__last_update = None
+    self.__snapshot = None
+    self.__locality_tree = LocalityTree()
+    self.__agent_digests = None
+    self.__chronos_version = None
+    self.__snapshot_file = ClusterSnapshotFile()
     self._update_config(config.pivot.master)
 
   @property
   def last_update(self):
     return self.__last_update
 
+  @property
+  def snapshot(self):
+    return self.__snapshot
+
+  @property
+  def locality_tree(self):
+    return self.__locality_tree
+
+  @property
+  def is_live(self):
+    """
+    Whether the cluster view is kept up to date by pushed events rather than by polling
+
+    """
+    return False
+
   async def update(self):
-    await self._discover_chronos()
+    await self.discover_chronos()
     status, agents, err = await self.__api.get_agents()
     if status == 200:
-      agents_in_db = set(a.id for a in (await self.__agent_db.get_all_agents()))
-      for a in agents:
-        agents_in_db.remove(a.id)
-        await self.__agent_db.update_agent(a)
-      await multi([self.__agent_db.remove_agent(aid) for aid in agents_in_db])
+      await self._apply_agents(agents)
     else:
-      self.logger.info('Failed to query agents')
-    self.__last_update = datetime.datetime.now(tz=None)
+      self.tick_logger.info('Failed to query agents')
+    self._mark_updated()
 
   async def callback(self):
     await self.update()
 
+  def invalidate_chronos(self):
+    """
+    Forces Chronos to be re-resolved on the next update, e.g., when its task is relaunched
+    without a new app version
+
+    """
+    self.__chronos_version = None
+
+  async def _apply_agents(self, agents):
+    """
+    Writes only the agents that are added or changed since the previous update, removes
+    the departed ones, and swaps the cluster snapshot only if anything has changed
+
+    """
+    digests = {a.id: a.digest for a in agents}
+    if self.__agent_digests is None:
+      # the first update also clears the agents left in the database by previous runs
+      prev_digests = {}
+      removed = set(a.id for a in await self.__agent_db.get_all_agents()) - digests.keys()
+    else:
+      prev_digests = self.__agent_digests
+      removed = prev_digests.keys() - digests.keys()
+    changed = [a for a in agents if prev_digests.get(a.id) != digests[a.id]]
+    if changed or removed:
+      self.logger.debug('Agents changed: %d, removed: %d'%(len(changed), len(removed)))
+    await self.__agent_db.update_agents(changed)
+    await self.__agent_db.remove_agents(removed)
+    for a in changed:
+      self.__locality_tree.update(a)
+    for agent_id in removed:
+      self.__locality_tree.remove(agent_id)
+    if changed or removed or not self.__snapshot:
+      self.__snapshot = ClusterSnapshot(agents)
+    self.__agent_digests = digests
+    self._mark_updated()
+
+  def _mark_updated(self):
+    self.__last_update = datetime.datetime.now(tz=None)
+    if self.__snapshot:
+      self.__snapshot_file.publish(self.__snapshot)
+
   async def _discover_leader(self):
     if not config.pivot.master:
       config.pivot.master = 'zk-1.zk'
@@ -81,12 +212,19 @@ class ClusterMonitor(AutonomousMonitor):
         return leader
     raise Exception('Cannot find leader. Probably all the registered masters are down')
 
-  async def _discover_chronos(self):
+  async def discover_chronos(self):
+    status, version, err = await self.__api.get_chronos_version()
+    if status != 200:
+      self.logger.error(err)
+      return
+    if version == self.__chronos_version:
+      return
     status, body, err = await self.__api.find_chronos()
     if status != 200:
       self.logger.error(err)
       return
     config.chronos.host, config.chronos.port = body
+    self.__chronos_version = version
 
   def _update_config(self, host):
     config.pivot.master = host
@@ -95,6 +233,276 @@ class ClusterMonitor(AutonomousMonitor):
     config.marathon.host = host
 
 
+class ClusterStreamMonitor(ClusterMonitor):
+  """
+  Cluster monitor backed by the event stream of the Mesos v1 operator API. The free
+  resources of each agent are maintained incrementally from the agent and task events, and
+  are published as soon as a batch of events is received. Offered and reserved resources
+  are not tracked, as they are not part of the operator events.
+
+  While the stream is disconnected, the monitor falls back to polling on demand.
+
+  """
+
+  TERMINAL_TASK_STATES = frozenset(['TASK_FINISHED', 'TASK_FAILED', 'TASK_KILLED',
+                                    'TASK_LOST', 'TASK_ERROR', 'TASK_DROPPED', 'TASK_GONE',
+                                    'TASK_GONE_BY_OPERATOR'])
+
+  def __init__(self, interval=30000):
+    super(ClusterStreamMonitor, self).__init__(interval)
+    self.__api = ClusterAPIManager()
+    self.__is_subscribed = False
+    self.__is_connected = False
+    self.__buf = b''
+    self.__agents, self.__tasks, self.__agent_tasks = {}, {}, {}
+    self.__free = {}
+    self.__dirty = set()
+    self.__stream = None
+
+  @property
+  def is_live(self):
+    return self.__is_connected
+
+  def stop(self):
+    super(ClusterStreamMonitor, self).stop()
+    if self.__stream:
+      self.__stream.close()
+    self.__stream, self.__buf, self.__dirty = None, b'', set()
+    self.__is_subscribed = self.__is_connected = False
+
+  async def callback(self):
+    if self.__is_subscribed:
+      return
+    self.__is_subscribed, self.__buf = True, b''
+    self.__agents, self.__tasks, self.__agent_tasks = {}, {}, {}
+    self.__free, self.__dirty = {}, set()
+    self.__stream = stream = HTTPStream()
+    try:
+      await self.discover_chronos()
+      status, _, err = await self.__api.subscribe(partial(self._on_chunk, stream), stream)
+      self.logger.warning('Mesos operator event stream is closed: %s'%(err or status))
+    finally:
+      # the monitor may have been stopped and restarted with a new stream in the meantime
+      if stream is self.__stream:
+        self.__stream = None
+        self.__is_subscribed = self.__is_connected = False
+
+  def _on_chunk(self, stream, chunk):
+    if stream is not self.__stream:
+      raise Exception('Mesos operator event stream is closed')
+    self.__buf += chunk
+    while True:
+      idx = self.__buf.find(b'\n')
+      if idx < 0:
+        break
+      length = int(self.__buf[:idx])
+      if len(self.__buf) < idx + 1 + length:
+        break
+      record, self.__buf = self.__buf[idx + 1: idx + 1 + length], self.__buf[idx + 1 + length:]
+      self._on_event(json.loads(record.decode('utf-8')))
+    if self.__dirty:
+      IOLoop.current().add_callback(self._publish)
+
+  def _on_event(self, event):
+    type = event.get('type')
+    if type == 'SUBSCRIBED':
+      state = event['subscribed'].get('get_state', {})
+      for a in state.get('get_agents', {}).get('agents', []):
+        self._add_agent(a)
+      for t in state.get('get_tasks', {}).get('tasks', []):
+        self._add_task(t)
+      self.__is_connected = True
+      self.logger.info('Subscribed to the Mesos operator event stream, '
+                       'agents: %d, tasks: %d'%(len(self.__agents), len(self.__tasks)))
+    elif type == 'AGENT_ADDED':
+      self._add_agent(event['agent_added']['agent'])
+    elif type == 'AGENT_REMOVED':
+      agent_id = event['agent_removed']['agent_id']['value']
+      self.__agents.pop(agent_id, None)
+      self.__dirty.add(agent_id)
+    elif type == 'TASK_ADDED':
+      self._add_task(event['task_added']['task'])
+    elif type == 'TASK_UPDATED':
+      # the ids of the task and its agent are only carried by the latest status of the task
+      status = event['task_updated']['status']
+      task_id = status['task_id']['value']
+      task = self.__tasks.get(task_id)
+      if task:
+        task['state'] = event['task_updated']['state']
+        if task['state'] in self.TERMINAL_TASK_STATES:
+          self._remove_task(task_id)
+        self.__dirty.add(status.get('agent_id', {}).get('value', task['agent_id']))
+    elif type == 'HEARTBEAT':
+      self._mark_updated()
+      IOLoop.current().add_callback(self.discover_chronos)
+
+  def _add_agent(self, agent):
+    info = agent['agent_info']
+    agent_id = info['id']['value']
+    self.__agents[agent_id] = dict(id=agent_id, hostname=info['hostname'],
+                                   attributes={a['name']: self._parse_value(a)
+                                               for a in info.get('attributes', [])},
+                                   resources=agent.get('total_resources', info['resources']))
+    self.__dirty.add(agent_id)
+
+  def _add_task(self, task):
+    task_id, agent_id = task['task_id']['value'], task['agent_id']['value']
+    if task['state'] in self.TERMINAL_TASK_STATES:
+      return
+    self.__tasks[task_id] = dict(agent_id=agent_id, state=task['state'],
+                                 resources=task.get('resources', []))
+    self.__agent_tasks.setdefault(agent_id, set()).add(task_id)
+    self.__dirty.add(agent_id)
+
+  def _remove_task(self, task_id):
+    task = self.__tasks.pop(task_id, None)
+    if task:
+      self.__agent_tasks.get(task['agent_id'], set()).discard(task_id)
+
+  async def _publish(self):
+    """
+    Recomputes the free resources of only the agents touched since the last publish
+
+    """
+    if not self.__dirty:
+      return
+    dirty, self.__dirty = self.__dirty, set()
+    for agent_id in dirty:
+      if agent_id in self.__agents:
+        self.__free[agent_id] = self._build_agent(self.__agents[agent_id])
+      else:
+        self.__free.pop(agent_id, None)
+        for task_id in list(self.__agent_tasks.get(agent_id, set())):
+          self._remove_task(task_id)
+    await self._apply_agents(list(self.__free.values()))
+
+  def _build_agent(self, agent):
+    used = [self.__tasks[t]['resources'] for t in self.__agent_tasks.get(agent['id'], set())]
+    total = self._sum_resources([agent['resources']])
+    used = self._sum_resources(used)
+    free_ports = self._subtract_ranges(total.get('ports', []), used.get('ports', []))
+    return Agent(id=agent['id'], hostname=agent['hostname'],
+                 resources=AgentResources(*[total.get(r, 0) - used.get(r, 0)
+                                            for r in ('cpus', 'mem', 'disk', 'gpus')],
+                                          ['%d-%d'%r for r in free_ports]),
+                 attributes=agent['attributes'])
+
+  def _sum_resources(self, resource_lists):
+    res = {}
+    for resources in resource_lists:
+      for r in resources:
+        if r['type'] == 'SCALAR':
+          res[r['name']] = res.get(r['name'], 0) + r['scalar']['value']
+        elif r['type'] == 'RANGES':
+          res.setdefault(r['name'], []).extend((int(rg['begin']), int(rg['end']))
+                                               for rg in r['ranges'].get('range', []))
+    return res
+
+  def _subtract_ranges(self, ranges, used):
+    free = []
+    for start, end in sorted(ranges):
+      for us, ue in sorted(used):
+        if ue < start or us > end:
+          continue
+        if us > start:
+          free += (start, us - 1),
+        start = ue + 1
+        if start > end:
+          break
+      if start <= end:
+        free += (start, end),
+    return free
+
+  def _parse_value(self, attr):
+    if attr['type'] == 'TEXT':
+      return attr['text']['value']
+    if attr['type'] == 'SCALAR':
+      return attr['scalar']['value']
+    return None
+
+
+class ClusterSnapshotFile(Loggable):
+  """
+  Cluster snapshot shared across the processes on a host through a file. The leader
+  publishes the snapshot by atomically replacing the file, which consists of a header,
+  i.e., magic, version, publishing time and payload length, followed by the JSON payload.
+  Readers map the file and only parse the payload when the version has changed. Snapshots
+  that have not been republished within `max_age` seconds are deemed stale, e.g., left by
+  a former leader.
+
+  """
+
+  MAGIC = b'PVCS'
+  HEADER = struct.Struct('<4sQdQ')
+
+  def __init__(self, path=config.cache.cluster_snapshot_path,
+               max_age=config.cache.cluster_snapshot_max_age):
+    self.__path = path
+    self.__max_age = max_age
+    self.__version = None
+    self.__snapshot = None
+    self.__chronos = None
+
+  def publish(self, snapshot):
+    """
+    Writes the snapshot along with the Chronos endpoint. The version is only bumped if
+    either has changed, otherwise the file is rewritten to renew its publishing time.
+
+    :param snapshot: cluster.ClusterSnapshot
+
+    """
+    chronos = [config.chronos.host, config.chronos.port]
+    if self.__version is None:
+      self.__version = self._read_header()[1]
+    if snapshot is not self.__snapshot or chronos != self.__chronos:
+      self.__version += 1
+      self.__snapshot, self.__chronos = snapshot, chronos
+    payload = json.dumps(dict(chronos=chronos,
+                              agents=[a.to_save() for a in snapshot.agents])).encode('utf-8')
+    tmp_path = '%s.%d'%(self.__path, os.getpid())
+    try:
+      with open(tmp_path, 'wb') as f:
+        f.write(self.HEADER.pack(self.MAGIC, self.__version, time.time(), len(payload)))
+        f.write(payload)
+      os.replace(tmp_path, self.__path)
+    except OSError as e:
+      self.logger.error('Failed to publish the cluster snapshot: %s'%e)
+
+  def load(self):
+    """
+    Reads the snapshot published by the leader
+
+    :return: cluster.ClusterSnapshot, or None if there is no fresh snapshot
+
+    """
+    try:
+      with open(self.__path, 'rb') as f, \
+          mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        magic, version, published_at, length = self.HEADER.unpack_from(buf, 0)
+        if magic != self.MAGIC or time.time() - published_at > self.__max_age:
+          return None
+        if version != self.__version:
+          payload = json.loads(buf[self.HEADER.size:self.HEADER.size + length].decode('utf-8'))
+          agents = [Agent(**dict(a, resources=AgentResources(**a['resources'])))
+                    for a in payload['agents']]
+          self.__snapshot = ClusterSnapshot(agents)
+          self.__chronos, self.__version = payload['chronos'], version
+    except (OSError, ValueError, struct.error):
+      return None
+    config.chronos.host, config.chronos.port = self.__chronos
+    return self.__snapshot
+
+  def _read_header(self):
+    try:
+      with open(self.__path, 'rb') as f:
+        header = self.HEADER.unpack(f.read(self.HEADER.size))
+      if header[0] == self.MAGIC:
+        return header
+    except (OSError, struct.error):
+      pass
+    return self.MAGIC, 0, 0., 0
+
+
 class ClusterAPIManager(APIManager):
 
   async def get_masters(self):
@@ -158,6 +566,22 @@ class ClusterAPIManager(APIManager):
              for h in body['slaves']]
     return status, agents, None
 
+  async def get_chronos_version(self):
+    api = config.marathon
+    status, body, err = await self.http_cli.get(api.host, api.port,
+                                                '%s/apps/sys/chronos/versions'%api.endpoint)
+    if status != 200:
+      return status, None, err
+    if not body['versions']:
+      return 503, None, 'Chronos is not yet deployed'
+    return 200, max(body['versions']), None
+
+  async def subscribe(self, streaming_callback, handle=None):
+    api = config.mesos
+    return await self.http_cli.stream(api.host, api.port, '%s/api/v1'%api.endpoint,
+                                      streaming_callback, method='POST', handle=handle,
+                                      body=dict(type='SUBSCRIBE'), Accept='application/json')
+
   async def find_chronos(self):
     api = config.marathon
     status, body, err = await self.http_cli.get(api.host, api.port,
@@ -175,6 +599,10 @@ class MasterDBManager(Manager):
   def __init__(self):
     self.__master_col = MongoClient()[config.db.name].master
 
+  async def ensure_indexes(self):
+    await self.__master_col.create_indexes([IndexModel('hostname', unique=True),
+                                            IndexModel('is_leader')])
+
   async def get_masters(self):
     return [Master(**m) async for m in self.__master_col.find()]
 
@@ -192,6 +620,13 @@ class AgentDBManager(Manager):
   def __init__(self):
     self.__agent_col = MongoClient()[config.db.name].agent
 
+  async def ensure_indexes(self):
+    await self.__agent_col.create_indexes([IndexModel('hostname', unique=True),
+                                           IndexModel('id')]
+                                          + [IndexModel('attributes.%s'%k)
+                                             for k in ('cloud', 'region', 'zone', 'host',
+                                                       'public_ip', 'fqdn')])
+
   async def get_all_agents(self):
     return [Agent(**a, resources=AgentResources(**a.pop('resources', None)))
             async for a in self.__agent_col.find()]
@@ -207,6 +642,18 @@ class AgentDBManager(Manager):
     await self.__agent_col.replace_one(dict(hostname=agent.hostname), agent.to_save(),
                                        upsert=True)
 
+  async def update_agents(self, agents):
+    if not agents:
+      return
+    await self.__agent_col.bulk_write([ReplaceOne(dict(hostname=a.hostname), a.to_save(),
+                                                  upsert=True)
+                                       for a in agents], ordered=False)
+
   async def remove_agent(self, agent_id):
     await self.__agent_col.delete_one(dict(id=agent_id))
 
+  async def remove_agents(self, agent_ids):
+    if not agent_ids:
+      return
+    await self.__agent_col.delete_many(dict(id={'$in': list(agent_ids)}))
+
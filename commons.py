@@ -1,13 +1,31 @@
+import os
 import sys
 import json
+import time
+import random
+import socket
+import queue
+import atexit
 import logging
+import threading
+import collections
 import tornado
+import tornado.process
 
 from abc import ABCMeta, abstractmethod
+from logging.handlers import QueueHandler, QueueListener
 from tornado.httpclient import AsyncHTTPClient, HTTPError
 from tornado.ioloop import PeriodicCallback
-from tornado.gen import sleep
+from tornado.concurrent import Future, chain_future
+from tornado.gen import sleep, convert_yielded
+try:
+  from tornado.simple_httpclient import HTTPTimeoutError
+except ImportError:
+  # prior to Tornado 5.1, the simple client raises plain HTTP errors upon timeouts
+  HTTPTimeoutError = None
 from motor.motor_tornado import MotorClient
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
 
 from util import dirname
 from config import config
@@ -23,22 +41,119 @@ class Singleton(type):
         return cls._instances[cls]
 
 
+class _LogPipeline:
+  """
+  Log records are put into an in-memory queue and written to stdout and the log file by a
+  background thread, so that the IOLoop never blocks on the disk. The thread does not
+  survive a fork, hence each process lazily starts its own along with its own log file,
+  i.e., `pivot.log` before forking and `pivot-<task ID>.log` in the forked workers.
+
+  """
+
+  __lock = threading.Lock()
+  __pid = None
+  __queue = None
+
+  @classmethod
+  def get_queue(cls):
+    if cls.__pid != os.getpid():
+      with cls.__lock:
+        if cls.__pid != os.getpid():
+          cls.__queue = cls._start_listener()
+          cls.__pid = os.getpid()
+    return cls.__queue
+
+  @classmethod
+  def _start_listener(cls):
+    fmt = logging.Formatter('%(asctime)s|%(levelname)s|%(process)d|%(name)s.%(funcName)s'
+                            '::%(lineno)s\t%(message)s')
+    task_id = tornado.process.task_id()
+    stream_hdlr = logging.StreamHandler(sys.stdout)
+    stream_hdlr.setFormatter(fmt)
+    file_hdlr = logging.FileHandler('%s/log/%s.log'%(dirname(__file__),
+                                                     'pivot' if task_id is None
+                                                     else 'pivot-%d'%task_id))
+    file_hdlr.setFormatter(fmt)
+    log_queue = queue.Queue()
+    listener = QueueListener(log_queue, stream_hdlr, file_hdlr)
+    listener.start()
+    atexit.register(listener.stop)
+    return log_queue
+
+
+class _ProcessQueueHandler(QueueHandler):
+
+  def __init__(self):
+    super(_ProcessQueueHandler, self).__init__(None)
+
+  def enqueue(self, record):
+    _LogPipeline.get_queue().put_nowait(record)
+
+
+class RateLimitFilter(logging.Filter):
+  """
+  Lets through at most one record per call site every `interval` seconds, and reports the
+  number of records suppressed in between along with the next one
+
+  """
+
+  def __init__(self, interval):
+    super(RateLimitFilter, self).__init__()
+    self.__interval = interval
+    self.__sites = {}
+
+  def filter(self, record):
+    key, now = (record.pathname, record.lineno), time.monotonic()
+    last, suppressed = self.__sites.get(key, (None, 0))
+    if last is not None and now - last < self.__interval:
+      self.__sites[key] = last, suppressed + 1
+      return False
+    self.__sites[key] = now, 0
+    if suppressed:
+      record.msg = '%s (%d similar message(s) suppressed)'%(record.getMessage(), suppressed)
+      record.args = None
+    return True
+
+
+_loggers = {}
+
+
+def get_logger(name, rate_limited=False):
+  """
+  Gets the logger of the name, which is configured upon the first call only. Rate-limited
+  loggers are meant for the messages logged on every tick of periodic tasks.
+
+  """
+  name = '%s.tick'%name if rate_limited else name
+  logger = _loggers.get(name)
+  if not logger:
+    logger = logging.getLogger(name)
+    logger.setLevel(config.log.level.upper())
+    logger.propagate = False
+    logger.addHandler(_ProcessQueueHandler())
+    if rate_limited:
+      logger.addFilter(RateLimitFilter(config.log.tick_interval))
+    _loggers[name] = logger
+  return logger
+
+
 class Loggable(object):
 
   @property
   def logger(self):
-    fmt = logging.Formatter('%(asctime)s|%(levelname)s|%(process)d|%(name)s.%(funcName)s'
-                            '::%(lineno)s\t%(message)s')
-    logger = logging.getLogger(self.__class__.__name__)
-    logger.setLevel(logging.INFO)
-    if not logger.handlers:
-      stream_hdlr = logging.StreamHandler(sys.stdout)
-      stream_hdlr.setFormatter(fmt)
-      file_hdlr = logging.FileHandler('%s/log/pivot.log'%dirname(__file__))
-      file_hdlr.setFormatter(fmt)
-      logger.addHandler(stream_hdlr)
-      logger.addHandler(file_hdlr)
-    return logger
+    return get_logger(self.__class__.__name__)
+
+  @property
+  def tick_logger(self):
+    return get_logger(self.__class__.__name__, rate_limited=True)
+
+
+def get_process_id():
+  """
+  Identifies the current process across the forked workers and PIVOT replicas
+
+  """
+  return '%s:%d'%(socket.gethostname(), os.getpid())
 
 
 class MongoClient(MotorClient, metaclass=Singleton):
@@ -47,8 +162,44 @@ class MongoClient(MotorClient, metaclass=Singleton):
     super(MongoClient, self).__init__(config.db.host, config.db.port, *args, **kwargs)
 
 
+def configure_http_client():
+  """
+  Configures the process-wide HTTP client from the `http` section of config.yml. The curl
+  client keeps connections alive and pools them per host, whereas Tornado's simple client
+  opens a new connection for every request and is only used if pycurl is unavailable.
+
+  """
+  cfg = config.http
+  defaults = dict(connect_timeout=cfg.connect_timeout, request_timeout=cfg.request_timeout)
+  if cfg.client == 'curl':
+    try:
+      import pycurl
+      from tornado.curl_httpclient import CurlAsyncHTTPClient
+
+      class PooledCurlAsyncHTTPClient(CurlAsyncHTTPClient):
+
+        def initialize(self, max_clients=10, defaults=None, max_host_connections=0):
+          super(PooledCurlAsyncHTTPClient, self).initialize(max_clients, defaults)
+          if max_host_connections:
+            self._multi.setopt(pycurl.M_MAX_HOST_CONNECTIONS, max_host_connections)
+
+      AsyncHTTPClient.configure(PooledCurlAsyncHTTPClient, max_clients=cfg.max_clients,
+                                max_host_connections=cfg.max_host_connections,
+                                defaults=defaults)
+      return
+    except ImportError as e:
+      sys.stderr.write('%s, fall back to the simple HTTP client\n'%e)
+  AsyncHTTPClient.configure(None, max_clients=cfg.max_clients, defaults=defaults)
+
+
+configure_http_client()
+
+
 class AsyncHttpClientWrapper(Loggable):
 
+  __breakers = {}
+  __inflight = {}
+
   def __init__(self):
     self.__cli = AsyncHTTPClient()
     self.__headers = {'Content-Type': 'application/json'}
@@ -65,28 +216,227 @@ class AsyncHttpClientWrapper(Loggable):
   async def delete(self, host, port, endpoint, body=None, is_https=False, **headers):
     return await self._fetch(host, port, endpoint, 'DELETE', body, is_https, **headers)
 
-  async def _fetch(self, host, port, endpoint, method, body, is_https=False, **headers):
+  async def stream(self, host, port, endpoint, streaming_callback, method='GET', body=None,
+                   is_https=False, handle=None, **headers):
+    """
+    Issues a long-lived request and feeds the response body to `streaming_callback` chunk
+    by chunk. Every stream uses a dedicated client so that it does not hold up the
+    connection slots of regular requests, and can be closed through `handle`.
+
+    :param handle: commons.HTTPStream, to close the stream from outside
+
+    """
     protocol = 'https' if is_https else 'http'
+    cli = AsyncHTTPClient(force_instance=True)
+    if isinstance(body, dict):
+      body = json.dumps(body)
+    fetched, done = cli.fetch('%s://%s:%d%s'%(protocol, host, port, endpoint),
+                              method=method, body=body, request_timeout=0,
+                              streaming_callback=streaming_callback,
+                              headers=dict(**self.__headers, **headers)), Future()
+    # the fetch is abandoned once the stream is closed, its outcome is then irrelevant
+    fetched.add_done_callback(lambda f: f.exception())
+    chain_future(fetched, done)
+    if handle:
+      handle.open(cli, done)
     try:
-      if isinstance(body, dict):
-        body = json.dumps(body)
-      r = await self.__cli.fetch('%s://%s:%d%s'%(protocol, host, port, endpoint),
-                                 method=method, body=body, request_timeout=60,
-                                 headers=dict(**self.__headers, **headers))
-      body = r.body.decode('utf-8')
-      if body:
-        body = json.loads(body)
-      return 200, body, None
+      await done
+      return 200, None, None
+    except HTTPError as e:
+      return e.code, None, e.message
+    except (ConnectionRefusedError, ConnectionResetError) as e:
+      return 503, None, str(e)
+    finally:
+      if handle:
+        handle.close()
+      else:
+        cli.close()
+
+  async def _fetch(self, host, port, endpoint, method, body, is_https=False, **headers):
+    url = '%s://%s:%d%s'%('https' if is_https else 'http', host, port, endpoint)
+    if method == 'GET':
+      # single flight: concurrent identical GETs share one upstream request
+      key = (method, url)
+      inflight = AsyncHttpClientWrapper.__inflight
+      if key not in inflight:
+        inflight[key] = convert_yielded(self._fetch_raw(host, port, url, method, body,
+                                                        **headers))
+        inflight[key].add_done_callback(lambda _: inflight.pop(key, None))
+      status, resp_body, err = await inflight[key]
+    else:
+      status, resp_body, err = await self._fetch_raw(host, port, url, method, body, **headers)
+    if status != 200:
+      return status, None, err
+    try:
+      # decoded per caller, so that callers sharing a response do not share mutable objects
+      return 200, resp_body and json.loads(resp_body), None
     except json.JSONDecodeError as de:
       return 422, None, de.msg
-    except HTTPError as e:
-      if e.code == 599:
-        return e.code, None, e.message
-      return e.code, None, e.response.body.decode('utf-8')
-    except (ConnectionRefusedError, ConnectionResetError):
-      self.logger.warning('Connection refused/reset, retry after 3 seconds')
-      sleep(3)
-      return await self._fetch(host, port, endpoint, method, body, is_https, **headers)
+
+  async def _fetch_raw(self, host, port, url, method, body, **headers):
+    cfg, breaker = config.http, self._get_circuit_breaker(host, port)
+    if isinstance(body, dict):
+      body = json.dumps(body)
+    for attempt in range(cfg.max_retries + 1):
+      if not breaker.allow():
+        return 503, None, 'Circuit to %s:%d is open, the upstream is unavailable'%(host, port)
+      try:
+        r = await self.__cli.fetch(url, method=method, body=body,
+                                   headers=dict(**self.__headers, **headers))
+        breaker.record_success()
+        return 200, r.body.decode('utf-8'), None
+      except HTTPError as e:
+        if e.code != 599:
+          breaker.record_success()
+          return e.code, None, e.response.body.decode('utf-8')
+        breaker.record_failure()
+        status, err = e.code, e.message
+        # do not pile up retries on top of a request that has already timed out
+        if self._is_timeout(e):
+          return status, None, err
+      except OSError as e:
+        # e.g., connection refused or reset, unreachable host or failed DNS resolution
+        breaker.record_failure()
+        status, err = 599, str(e)
+      except BaseException:
+        # a half-open circuit must not be left waiting for the outcome of its probe
+        breaker.record_failure()
+        raise
+      if attempt < cfg.max_retries:
+        # exponential backoff with full jitter
+        delay = random.uniform(0, min(cfg.max_retry_backoff, cfg.retry_backoff * 2 ** attempt))
+        self.logger.warning('Connection to %s:%d failed (%s), '
+                            'retry in %.2f seconds'%(host, port, err, delay))
+        await sleep(delay)
+    return status, None, err
+
+  def _is_timeout(self, err):
+    """
+    Checks whether an HTTP error of code 599 is a connect or request timeout
+
+    :param err: tornado.httpclient.HTTPError
+    :return: bool
+
+    """
+    # CURLE_OPERATION_TIMEDOUT, raised by the curl client upon either timeout
+    if getattr(err, 'errno', None) == 28:
+      return True
+    if HTTPTimeoutError:
+      return isinstance(err, HTTPTimeoutError)
+    return err.message in ('Timeout', 'Timeout while connecting', 'Timeout during request',
+                           'Timeout in request queue')
+
+  def _get_circuit_breaker(self, host, port):
+    breaker = AsyncHttpClientWrapper.__breakers.get((host, port))
+    if not breaker:
+      breaker = CircuitBreaker(config.http.breaker_threshold, config.http.breaker_timeout)
+      AsyncHttpClientWrapper.__breakers[(host, port)] = breaker
+    return breaker
+
+
+class HTTPStream:
+  """
+  Handle of a stream issued by `AsyncHttpClientWrapper.stream`. Closing it closes the
+  client of the stream, which terminates the transfer with the curl client, and returns
+  from the stream right away. As the simple client keeps delivering the chunks received
+  on its open connection, streaming callbacks should raise once the stream is closed.
+
+  """
+
+  def __init__(self):
+    self.__cli = None
+    self.__done = None
+    self.__is_closed = False
+
+  @property
+  def is_closed(self):
+    return self.__is_closed
+
+  def open(self, cli, done):
+    self.__cli, self.__done = cli, done
+    if self.__is_closed:
+      self.close()
+
+  def close(self):
+    self.__is_closed = True
+    if self.__done and not self.__done.done():
+      self.__done.set_result(None)
+    if self.__cli:
+      self.__cli.close()
+      self.__cli = None
+
+
+class CircuitBreaker:
+  """
+  Circuit breaker of an upstream. The circuit opens after `threshold` consecutive
+  connection failures and rejects requests for `timeout` seconds, after which a single
+  probe request is let through to decide whether to close the circuit or keep it open.
+
+  """
+
+  def __init__(self, threshold=5, timeout=30):
+    self.__threshold = threshold
+    self.__timeout = timeout
+    self.__n_failures = 0
+    self.__opened_at = None
+    self.__is_probing = False
+
+  @property
+  def is_open(self):
+    return self.__opened_at is not None
+
+  def allow(self):
+    if self.__opened_at is None:
+      return True
+    if time.monotonic() - self.__opened_at < self.__timeout or self.__is_probing:
+      return False
+    self.__is_probing = True
+    return True
+
+  def record_success(self):
+    self.__n_failures, self.__opened_at, self.__is_probing = 0, None, False
+
+  def record_failure(self):
+    self.__n_failures += 1
+    if self.__is_probing or self.__n_failures >= self.__threshold:
+      self.__opened_at = time.monotonic()
+    self.__is_probing = False
+
+
+class TTLCache:
+  """
+  Per-process cache whose entries expire after `ttl` seconds, and the least recently used
+  entries are evicted once it holds more than `maxsize` entries
+
+  """
+
+  def __init__(self, maxsize=256, ttl=5):
+    self.__maxsize = maxsize
+    self.__ttl = ttl
+    self.__entries = collections.OrderedDict()
+
+  def get(self, key):
+    entry = self.__entries.get(key)
+    if not entry:
+      return None
+    value, expire_at = entry
+    if time.monotonic() > expire_at:
+      self.__entries.pop(key, None)
+      return None
+    self.__entries.move_to_end(key)
+    return value
+
+  def put(self, key, value):
+    self.__entries[key] = value, time.monotonic() + self.__ttl
+    self.__entries.move_to_end(key)
+    while len(self.__entries) > self.__maxsize:
+      self.__entries.popitem(last=False)
+
+  def invalidate(self, key):
+    self.__entries.pop(key, None)
+
+  def clear(self):
+    self.__entries.clear()
 
 
 class Manager(Loggable, metaclass=Singleton):
@@ -117,8 +467,66 @@ class AutonomousMonitor(Loggable, metaclass=ABCMeta):
     self.__cb.start()
 
   def stop(self):
-    self.__cb.stop()
+    if self.__cb:
+      self.__cb.stop()
 
   @abstractmethod
   async def callback(self):
     raise NotImplemented
+
+
+class LeaderElection(AutonomousMonitor):
+  """
+  Elects one leader among all the processes sharing the database, including the forked
+  workers and other PIVOT replicas, through a lease document. The leader renews the lease
+  three times per `lease_ttl`; if it fails to, any other process takes over once the lease
+  expires. `on_elected` and `on_demoted` are called upon the transitions.
+
+  """
+
+  def __init__(self, name, on_elected, on_demoted, lease_ttl=config.pivot.leader_lease_ttl):
+    super(LeaderElection, self).__init__(int(lease_ttl * 1000 / 3))
+    self.__name = name
+    self.__on_elected = on_elected
+    self.__on_demoted = on_demoted
+    self.__lease_ttl = lease_ttl
+    self.__is_leader = False
+    self.__is_indexed = False
+    self.__lease_col = MongoClient()[config.db.name].leader
+
+  @property
+  def is_leader(self):
+    return self.__is_leader
+
+  async def ensure_indexes(self):
+    # the unique index turns a concurrent takeover into a DuplicateKeyError on upsert
+    await self.__lease_col.create_index('id', unique=True)
+    self.__is_indexed = True
+
+  async def callback(self):
+    try:
+      is_leader = await self._acquire_lease()
+    except Exception as e:
+      self.logger.error(str(e))
+      is_leader = False
+    if is_leader and not self.__is_leader:
+      self.logger.info("Elected as the leader of '%s'"%self.__name)
+      self.__is_leader = True
+      self.__on_elected()
+    elif not is_leader and self.__is_leader:
+      self.logger.info("No longer the leader of '%s'"%self.__name)
+      self.__is_leader = False
+      self.__on_demoted()
+
+  async def _acquire_lease(self):
+    if not self.__is_indexed:
+      await self.ensure_indexes()
+    now, owner = time.time(), get_process_id()
+    try:
+      lease = await self.__lease_col.find_one_and_update(
+        {'id': self.__name, '$or': [dict(owner=owner), {'expire_at': {'$lt': now}}]},
+        {'$set': dict(owner=owner, expire_at=now + self.__lease_ttl)},
+        upsert=True, return_document=ReturnDocument.AFTER)
+    except DuplicateKeyError:
+      return False
+    return lease['owner'] == owner
@@ -7,10 +7,11 @@ from util import dirname
 
 class API:
 
-  def __init__(self, port, endpoint, host=None, *args, **kwargs):
+  def __init__(self, port, endpoint, host=None, max_concurrency=16, *args, **kwargs):
     self.__host = host
     self.__port = int(port)
     self.__endpoint = endpoint
+    self.__max_concurrency = int(max_concurrency)
 
   @property
   def host(self):
@@ -24,6 +25,10 @@ class API:
   def endpoint(self):
     return self.__endpoint
 
+  @property
+  def max_concurrency(self):
+    return self.__max_concurrency
+
   @host.setter
   def host(self, h):
     self.__host = h
@@ -35,16 +40,31 @@ class API:
 
 class MesosAPI(API):
   
-  def __init__(self, port=5050, *args, **kwargs):
+  def __init__(self, port=5050, monitor='poll', *args, **kwargs):
     kwargs.update(port=port, endpoint='')
     super(MesosAPI, self).__init__(*args, **kwargs)
+    self.__monitor = monitor
+
+  @property
+  def monitor(self):
+    return self.__monitor
 
 
 class MarathonAPI(API):
 
-  def __init__(self, port=8080, *args, **kwargs):
+  def __init__(self, port=8080, event_stream=True, state_ttl=30, *args, **kwargs):
     kwargs.update(port=port, endpoint='/v2')
     super(MarathonAPI, self).__init__(*args, **kwargs)
+    self.__event_stream = event_stream
+    self.__state_ttl = state_ttl
+
+  @property
+  def event_stream(self):
+    return self.__event_stream
+
+  @property
+  def state_ttl(self):
+    return self.__state_ttl
 
 
 class ChronosAPI(API):
@@ -71,12 +91,14 @@ class CephAPI(API):
 class GeneralConfig:
 
   def __init__(self, master, port=9090, n_parallel=1,
-               scheduler='schedule.universal.DefaultGlobalScheduler', https=False, *args, **kwargs):
+               scheduler='schedule.universal.DefaultGlobalScheduler', https=False,
+               leader_lease_ttl=15, *args, **kwargs):
     self.__master = master
     self.__port = port
     self.__n_parallel = n_parallel
     self.__scheduler = scheduler
     self.__https = https
+    self.__leader_lease_ttl = float(leader_lease_ttl)
 
   @property
   def master(self):
@@ -102,6 +124,10 @@ class GeneralConfig:
   def https(self):
     return self.__https
 
+  @property
+  def leader_lease_ttl(self):
+    return self.__leader_lease_ttl
+
 
 class DatabaseConfig:
 
@@ -123,6 +149,141 @@ class DatabaseConfig:
     return self.__name
 
 
+class HttpClientConfig:
+
+  def __init__(self, client='curl', max_clients=64, max_host_connections=16,
+               connect_timeout=10, request_timeout=60, max_retries=3, retry_backoff=.5,
+               max_retry_backoff=10, breaker_threshold=5, breaker_timeout=30, *args, **kwargs):
+    self.__client = client
+    self.__max_clients = int(max_clients)
+    self.__max_host_connections = int(max_host_connections)
+    self.__connect_timeout = float(connect_timeout)
+    self.__request_timeout = float(request_timeout)
+    self.__max_retries = int(max_retries)
+    self.__retry_backoff = float(retry_backoff)
+    self.__max_retry_backoff = float(max_retry_backoff)
+    self.__breaker_threshold = int(breaker_threshold)
+    self.__breaker_timeout = float(breaker_timeout)
+
+  @property
+  def client(self):
+    return self.__client
+
+  @property
+  def max_clients(self):
+    return self.__max_clients
+
+  @property
+  def max_host_connections(self):
+    return self.__max_host_connections
+
+  @property
+  def connect_timeout(self):
+    return self.__connect_timeout
+
+  @property
+  def request_timeout(self):
+    return self.__request_timeout
+
+  @property
+  def max_retries(self):
+    return self.__max_retries
+
+  @property
+  def retry_backoff(self):
+    return self.__retry_backoff
+
+  @property
+  def max_retry_backoff(self):
+    return self.__max_retry_backoff
+
+  @property
+  def breaker_threshold(self):
+    return self.__breaker_threshold
+
+  @property
+  def breaker_timeout(self):
+    return self.__breaker_timeout
+
+
+class CacheConfig:
+
+  def __init__(self, appliance_ttl=5, appliance_size=256,
+               cluster_snapshot_path='/tmp/pivot-cluster.snapshot', cluster_snapshot_max_age=90,
+               *args, **kwargs):
+    self.__appliance_ttl = float(appliance_ttl)
+    self.__appliance_size = int(appliance_size)
+    self.__cluster_snapshot_path = cluster_snapshot_path
+    self.__cluster_snapshot_max_age = float(cluster_snapshot_max_age)
+
+  @property
+  def appliance_ttl(self):
+    return self.__appliance_ttl
+
+  @property
+  def appliance_size(self):
+    return self.__appliance_size
+
+  @property
+  def cluster_snapshot_path(self):
+    return self.__cluster_snapshot_path
+
+  @property
+  def cluster_snapshot_max_age(self):
+    return self.__cluster_snapshot_max_age
+
+
+class ScheduleConfig:
+
+  def __init__(self, interval=1, batch_size=32, recheck_interval=10, lease_ttl=30,
+               solver_budget=2, solver_workers=1, *args, **kwargs):
+    self.__interval = float(interval)
+    self.__batch_size = int(batch_size)
+    self.__recheck_interval = float(recheck_interval)
+    self.__lease_ttl = float(lease_ttl)
+    self.__solver_budget = float(solver_budget)
+    self.__solver_workers = int(solver_workers)
+
+  @property
+  def interval(self):
+    return self.__interval
+
+  @property
+  def batch_size(self):
+    return self.__batch_size
+
+  @property
+  def recheck_interval(self):
+    return self.__recheck_interval
+
+  @property
+  def lease_ttl(self):
+    return self.__lease_ttl
+
+  @property
+  def solver_budget(self):
+    return self.__solver_budget
+
+  @property
+  def solver_workers(self):
+    return self.__solver_workers
+
+
+class LogConfig:
+
+  def __init__(self, level='info', tick_interval=60, *args, **kwargs):
+    self.__level = level
+    self.__tick_interval = float(tick_interval)
+
+  @property
+  def level(self):
+    return self.__level
+
+  @property
+  def tick_interval(self):
+    return self.__tick_interval
+
+
 class Configuration:
 
   @classmethod
@@ -140,18 +301,50 @@ class Configuration:
       sys.stderr.write(str(e) + '\n')
       sys.stderr.write('Database configuration is not set correctly\n')
       sys.exit(2)
+    try:
+      http_cfg = HttpClientConfig(**cfg.get('http', {}))
+    except Exception as e:
+      sys.stderr.write(str(e) + '\n')
+      sys.stderr.write('HTTP client configuration is not set correctly\n')
+      sys.exit(3)
+    try:
+      cache_cfg = CacheConfig(**cfg.get('cache', {}))
+    except Exception as e:
+      sys.stderr.write(str(e) + '\n')
+      sys.stderr.write('Cache configuration is not set correctly\n')
+      sys.exit(4)
+    try:
+      schedule_cfg = ScheduleConfig(**cfg.get('schedule', {}))
+    except Exception as e:
+      sys.stderr.write(str(e) + '\n')
+      sys.stderr.write('Schedule configuration is not set correctly\n')
+      sys.exit(5)
+    try:
+      log_cfg = LogConfig(**cfg.get('log', {}))
+    except Exception as e:
+      sys.stderr.write(str(e) + '\n')
+      sys.stderr.write('Log configuration is not set correctly\n')
+      sys.exit(6)
     return Configuration(pivot=pivot_cfg,
                          db=db_cfg,
+                         http=http_cfg,
+                         cache=cache_cfg,
+                         schedule=schedule_cfg,
+                         log=log_cfg,
                          mesos=MesosAPI(**cfg.get('mesos', {})),
                          marathon=MarathonAPI(**cfg.get('marathon', {})),
                          chronos=ChronosAPI(**cfg.get('chronos', {})),
                          exhibitor=ExhibitorAPI(**cfg.get('exhibitor', {})),
                          ceph=CephAPI(**cfg.get('ceph', {})))
 
-  def __init__(self, pivot, db, mesos=None, marathon=None, chronos=None,
-               exhibitor=None, ceph=None, *args, **kwargs):
+  def __init__(self, pivot, db, http=None, cache=None, schedule=None, log=None, mesos=None,
+               marathon=None, chronos=None, exhibitor=None, ceph=None, *args, **kwargs):
     self.__pivot = pivot
     self.__db = db
+    self.__http = http or HttpClientConfig()
+    self.__cache = cache or CacheConfig()
+    self.__schedule = schedule or ScheduleConfig()
+    self.__log = log or LogConfig()
     self.__mesos = mesos
     self.__marathon = marathon
     self.__chronos = chronos
@@ -166,6 +359,22 @@ class Configuration:
   def db(self):
     return self.__db
 
+  @property
+  def http(self):
+    return self.__http
+
+  @property
+  def cache(self):
+    return self.__cache
+
+  @property
+  def schedule(self):
+    return self.__schedule
+
+  @property
+  def log(self):
+    return self.__log
+
   @property
   def mesos(self):
     return self.__mesos
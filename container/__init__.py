@@ -7,6 +7,7 @@ import volume
 import schedule
 
 from enum import Enum
+from types import MappingProxyType
 
 from util import parse_datetime
 from locality import Placement
@@ -161,6 +162,8 @@ class Endpoint:
 
   """
 
+  __slots__ = ('__host', '__host_port', '__container_port', '__protocol', '__name', )
+
   def __init__(self, host, container_port, host_port, protocol='tcp', name=None, *args, **kwargs):
     self.__host = host
     self.__host_port = host_port
@@ -255,6 +258,8 @@ class Port:
 
   """
 
+  __slots__ = ('__container_port', '__host_port', '__protocol', '__name', )
+
   def __init__(self, container_port, host_port=0, protocol='tcp', name=None, *args, **kwargs):
     self.__container_port = container_port
     self.__host_port = host_port
@@ -449,6 +454,11 @@ class Container:
   REQUIRED = frozenset(['id', 'type', 'image', 'resources'])
   ID_PATTERN = r'[a-zA-Z0-9-]+'
 
+  __slots__ = ('__id', '__appliance', '__type', '__image', '__resources', '__cmd', '__args',
+               '__env', '__volumes', '__network_mode', '__endpoints', '__ports', '__state',
+               '__is_privileged', '__force_pull_image', '__dependencies',
+               '__user_schedule_hints', '__sys_schedule_hints', '__deployment', '__last_update', )
+
   @classmethod
   def parse(cls, data, from_user=True):
     if not isinstance(data, dict):
@@ -495,19 +505,19 @@ class Container:
     self.__image = image
     self.__resources = Resources(**resources)
     self.__cmd = cmd and str(cmd)
-    self.__args = [a and str(a) for a in args]
+    self.__args = tuple(a and str(a) for a in args)
     if self.__cmd and self.__args:
       raise ValueError("Cannot specify both 'cmd' and 'args'")
     self.__env = {k: v if v and isinstance(v, str) else json.dumps(v) for k, v in env.items()}
-    self.__volumes = [ContainerVolume(**v) for v in volumes]
+    self.__volumes = tuple(ContainerVolume(**v) for v in volumes)
     self.__network_mode = network_mode if isinstance(network_mode, NetworkMode) \
                           else NetworkMode(network_mode.upper())
-    self.__endpoints = [Endpoint(**e) for e in endpoints]
-    self.__ports = [Port(**p) for p in ports]
+    self.__endpoints = tuple(Endpoint(**e) for e in endpoints)
+    self.__ports = tuple(Port(**p) for p in ports)
     self.__state = state if isinstance(state, ContainerState) else ContainerState(state)
     self.__is_privileged = is_privileged
     self.__force_pull_image = force_pull_image
-    self.__dependencies = list(dependencies)
+    self.__dependencies = tuple(dependencies)
 
     if isinstance(user_schedule_hints, dict):
       self.__user_schedule_hints = ContainerScheduleHints(**user_schedule_hints)
@@ -624,7 +634,7 @@ class Container:
       - --data_dir
       - /home/user/data
     """
-    return list(self.__args)
+    return self.__args
 
   @property
   @swagger.property
@@ -639,7 +649,7 @@ class Container:
     example:
       DATA_DIR: /home/user/data
     """
-    return dict(self.__env)
+    return MappingProxyType(self.__env)
 
   @property
   @swagger.property
@@ -652,7 +662,7 @@ class Container:
     default: []
 
     """
-    return list(self.__volumes)
+    return self.__volumes
 
   @property
   @swagger.property
@@ -680,7 +690,7 @@ class Container:
     read_only: true
 
     """
-    return list(self.__endpoints)
+    return self.__endpoints
 
   @property
   @swagger.property
@@ -693,7 +703,7 @@ class Container:
     default: []
 
     """
-    return list(self.__ports)
+    return self.__ports
 
   @property
   @swagger.property
@@ -749,7 +759,7 @@ class Container:
       - c1
       - j2
     """
-    return list(self.__dependencies)
+    return self.__dependencies
 
   @property
   @swagger.property
@@ -827,7 +837,7 @@ class Container:
 
   @endpoints.setter
   def endpoints(self, endpoints):
-    self.__endpoints = list(endpoints)
+    self.__endpoints = tuple(endpoints)
 
   @state.setter
   def state(self, state):
@@ -847,10 +857,10 @@ class Container:
     self.__deployment = deployment
 
   def add_env(self, **env):
-    self.__env.update(env)
+    self.__env = dict(self.__env, **env)
 
   def add_dependency(self, dep):
-    self.__dependencies.append(dep)
+    self.__dependencies += dep,
 
   def to_render(self):
     return dict(id=self.id,
@@ -859,7 +869,7 @@ class Container:
                 image=self.image, resources=self.resources.to_render(),
                 endpoints=[e.to_render() for e in self.endpoints],
                 state=self.state.value,
-                dependencies=self.dependencies,
+                dependencies=list(self.dependencies),
                 user_schedule_hints=self.user_schedule_hints.to_render(),
                 sys_schedule_hints=self.sys_schedule_hints.to_render(),
                 deployment=self.deployment.to_render())
@@ -869,13 +879,13 @@ class Container:
                 appliance=self.appliance if isinstance(self.appliance, str) else self.appliance.id,
                 type=self.type.value,
                 image=self.image, resources=self.resources.to_save(),
-                cmd=self.cmd, args=self.args, env=self.env,
+                cmd=self.cmd, args=list(self.args), env=dict(self.env),
                 volumes=[v.to_save() for v in self.volumes],
                 network_mode=self.network_mode.value,
                 endpoints=[e.to_save() for e in self.endpoints],
                 ports=[p.to_save() for p in self.ports],
                 state=self.state.value, is_privileged=self.is_privileged,
-                force_pull_image=self.force_pull_image, dependencies=self.dependencies,
+                force_pull_image=self.force_pull_image, dependencies=list(self.dependencies),
                 last_update=self.last_update and self.last_update.isoformat(),
                 user_schedule_hints=self.user_schedule_hints.to_save(),
                 sys_schedule_hints=self.sys_schedule_hints.to_save(),
@@ -895,6 +905,83 @@ class Container:
                  and self.appliance == other.appliance))
 
 
+@swagger.model
+class ContainerSummary:
+  """
+  Brief of a container for listings, which is read from the database with a projection of
+  only the summarized fields
+
+  """
+
+  PROJECTION = dict(_id=0, id=1, appliance=1, type=1, state=1, last_update=1)
+
+  def __init__(self, id, appliance, type, state=ContainerState.SUBMITTED, last_update=None,
+               *args, **kwargs):
+    self.__id = id
+    self.__appliance = appliance
+    self.__type = type if isinstance(type, ContainerType) else ContainerType(type)
+    self.__state = state if isinstance(state, ContainerState) else ContainerState(state)
+    self.__last_update = parse_datetime(last_update)
+
+  @property
+  @swagger.property
+  def id(self):
+    """
+    Unique identifier of the container in an appliance
+    ---
+    type: str
+    example: test-container
+
+    """
+    return self.__id
+
+  @property
+  @swagger.property
+  def appliance(self):
+    """
+    The appliance in which the container is running
+    ---
+    type: str
+    example: test-app
+
+    """
+    return self.__appliance
+
+  @property
+  @swagger.property
+  def type(self):
+    """
+    Container type
+    ---
+    type: ContainerType
+    example: service
+
+    """
+    return self.__type
+
+  @property
+  @swagger.property
+  def state(self):
+    """
+    Container state as of the last update
+    ---
+    type: ContainerState
+
+    """
+    return self.__state
+
+  @property
+  def last_update(self):
+    return self.__last_update
+
+  def to_render(self):
+    return dict(id=self.id, appliance=self.appliance, type=self.type.value,
+                state=self.state.value)
+
+  def __repr__(self):
+    return '/%s/%s'%(self.appliance, self.id)
+
+
 @swagger.model
 class ContainerDeployment:
 
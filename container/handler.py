@@ -25,9 +25,15 @@ class ServicesHandler(RequestHandler, Loggable):
     """
     Get services in the requested appliance
     ---
+    parameters:
+      - name: summary
+        description: whether to list only the summaries of the services as of their last update
+        in: query
+        type: bool
+        example: false
     responses:
       200:
-        description: services in the requested appliance
+        description: services, or their summaries, in the requested appliance
         content:
           application/json:
             schema:
@@ -39,8 +45,12 @@ class ServicesHandler(RequestHandler, Loggable):
           application/json:
             schema: Error
     """
-    status, services, err = await self.__contr_mgr.get_containers(appliance=app_id,
-                                                                  type='service')
+    if self.get_query_argument('summary', 'false').lower() == 'true':
+      status, services, err = await self.__contr_mgr.get_container_summaries(appliance=app_id,
+                                                                             type='service')
+    else:
+      status, services, err = await self.__contr_mgr.get_containers(appliance=app_id,
+                                                                    type='service')
     self.set_status(status)
     self.write(json_encode([s.to_render() for s in services] if status == 200 else error(err)))
 
@@ -62,9 +72,15 @@ class JobsHandler(RequestHandler, Loggable):
     """
     Get jobs in the requested appliance
     ---
+    parameters:
+      - name: summary
+        description: whether to list only the summaries of the jobs as of their last update
+        in: query
+        type: bool
+        example: false
     responses:
       200:
-        description: jobs in the requested appliance
+        description: jobs, or their summaries, in the requested appliance
         content:
           application/json:
             schema:
@@ -76,7 +92,11 @@ class JobsHandler(RequestHandler, Loggable):
           application/json:
             schema: Error
     """
-    status, services, err = await self.__contr_mgr.get_containers(appliance=app_id, type='job')
+    if self.get_query_argument('summary', 'false').lower() == 'true':
+      status, services, err = await self.__contr_mgr.get_container_summaries(appliance=app_id,
+                                                                             type='job')
+    else:
+      status, services, err = await self.__contr_mgr.get_containers(appliance=app_id, type='job')
     self.set_status(status)
     self.write(json_encode([s.to_render() for s in services] if status == 200 else error(err)))
 
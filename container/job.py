@@ -20,6 +20,8 @@ class Job(Container):
 
   """
 
+  __slots__ = ('__retries', '__repeats', '__start_time', '__interval', )
+
   def __init__(self, resources, network_mode=NetworkMode.HOST,
                retries=1, repeats=1, start_time='', interval='2M', *args, **kwargs):
     super(Job, self).__init__(resources=resources, network_mode=network_mode, *args, **kwargs)
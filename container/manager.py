@@ -1,15 +1,23 @@
 import json
+import time
 import datetime
 
 import appliance.manager
 
 from datetime import timedelta
+from functools import partial
+from tornado.escape import url_escape
+from tornado.gen import multi
+from tornado.ioloop import IOLoop
+from tornado.locks import Semaphore
+from pymongo import ReplaceOne, IndexModel
 
 from config import config
-from commons import MongoClient
+from commons import MongoClient, AutonomousMonitor, HTTPStream
 from commons import APIManager, Manager
-from cluster.manager import AgentDBManager
+from cluster.manager import ClusterManager
 from container import Container, ContainerType, ContainerState, Endpoint, ContainerDeployment
+from container import ContainerSummary
 
 
 class ContainerManager(Manager):
@@ -18,18 +26,38 @@ class ContainerManager(Manager):
     self.__service_api = ServiceAPIManager()
     self.__job_api = JobAPIManager()
     self.__contr_db = ContainerDBManager()
-    self.__cluster_db = AgentDBManager()
+    self.__cluster_mgr = ClusterManager()
+    self.__event_monitor = ServiceEventMonitor()
+    self.__state_listeners = []
 
-  async def get_container(self, app_id, contr_id, ttl=0, full_blown=False):
+  def start_event_monitor(self):
+    self.__event_monitor.start()
+
+  def stop_event_monitor(self):
+    self.__event_monitor.stop()
+
+  def add_state_listener(self, listener):
+    """
+    Registers a callable to be invoked with the container whenever a refresh from upstream
+    changes the state of a container
+
+    :param listener: callable, takes a container.Container
+
+    """
+    self.__state_listeners.append(listener)
+
+  async def get_container(self, app_id, contr_id, ttl=None, full_blown=False):
     status, contr, err = await self.__contr_db.get_container(app_id, contr_id)
     if status == 404:
       return status, contr, err
-    if not contr.last_update or \
-        datetime.datetime.now(tz=None) - contr.last_update > timedelta(seconds=ttl):
+    if ttl is None:
+      await self.__event_monitor.sync()
+    if self._is_stale(contr, ttl, datetime.datetime.now(tz=None)):
       status, contr, err = await self._get_updated_container(contr)
       if status == 404 and contr.state != ContainerState.SUBMITTED:
         self.logger.info("Deleted ghost container: %s"%contr)
         await self.__contr_db.delete_container(contr)
+        self._invalidate_appliances(app_id)
         return 404, None, err
       if status == 200:
         contr.last_update = datetime.datetime.now(tz=None)
@@ -42,14 +70,14 @@ class ContainerManager(Manager):
       status, contr.appliance, err = await app_mgr.get_appliance(app_id)
     return 200, contr, None
 
-  async def get_containers(self, ttl=0, full_blown=False, **filters):
+  async def get_containers(self, ttl=None, full_blown=False, refresh=True, **filters):
     contrs = await self.__contr_db.get_containers(**filters)
     contrs_to_del, contrs_to_update = [], [],
+    if refresh and ttl is None:
+      await self.__event_monitor.sync()
     cur_time = datetime.datetime.now(tz=None)
-    for c in contrs:
-      if c.last_update and cur_time - c.last_update <= timedelta(seconds=ttl):
-        continue
-      status, c, err = await self._get_updated_container(c)
+    contrs_to_refresh = [c for c in contrs if refresh and self._is_stale(c, ttl, cur_time)]
+    for status, c, err in await self._get_updated_containers(contrs_to_refresh):
       if status == 404 and c.state != ContainerState.SUBMITTED:
         contrs_to_del.append(c)
       if status == 200:
@@ -62,15 +90,45 @@ class ContainerManager(Manager):
         self.logger.error(err)
       else:
         self.logger.info(msg)
+      self._invalidate_appliances(contrs_to_del[0].appliance)
     for c in contrs_to_update:
       c.last_update = datetime.datetime.now(tz=None)
-      await self.save_container(c, upsert=False)
+    await self.save_containers(contrs_to_update, upsert=False)
     if full_blown:
       app_mgr = appliance.manager.ApplianceManager()
+      app_ids = list(set([c.appliance for c in contrs]))
+      apps = {app_id: app for app_id, (_, app, _)
+              in zip(app_ids, await multi([app_mgr.get_appliance(app_id) for app_id in app_ids]))}
       for c in contrs:
-        _, c.appliance, _ = await app_mgr.get_appliance(c.appliance)
+        if apps[c.appliance]:
+          c.appliance = apps[c.appliance]
     return 200, contrs, None
 
+  async def get_container_summaries(self, **filters):
+    """
+    Lists the summaries of the containers as saved in the database, i.e., without refreshing
+    their states from upstream
+
+    """
+    return 200, await self.__contr_db.get_container_summaries(**filters), None
+
+  async def hydrate_container(self, contr):
+    """
+    Attaches the appliance metadata and volumes to the container without refreshing the
+    state of the container or its siblings from upstream
+
+    :param contr: container.Container
+
+    """
+    assert isinstance(contr, Container)
+    if isinstance(contr.appliance, str):
+      app_mgr = appliance.manager.ApplianceManager()
+      status, app, err = await app_mgr.hydrate_appliance(contr.appliance)
+      if status != 200:
+        return status, None, err
+      contr.appliance = app
+    return 200, contr, None
+
   async def create_container(self, data):
     status, contr, err = Container.parse(data)
     if status != 200:
@@ -103,6 +161,7 @@ class ContainerManager(Manager):
       if status == 404:
         await self.__contr_db.delete_container(contr)
     await self.__contr_db.delete_containers(appliance=app_id, id=contr_id)
+    self._invalidate_appliances(app_id)
     return 200, "Container '%s' is being deleted"%contr, None
 
   async def delete_containers(self, **filters):
@@ -140,30 +199,112 @@ class ContainerManager(Manager):
 
   async def save_container(self, contr, upsert=False):
     await self.__contr_db.save_container(contr, upsert=upsert)
+    self._invalidate_appliances(contr.appliance)
+
+  async def save_containers(self, contrs, upsert=False):
+    await self.__contr_db.save_containers(contrs, upsert=upsert)
+    self._invalidate_appliances(*[c.appliance for c in contrs])
+
+  def _invalidate_appliances(self, *apps):
+    app_mgr = appliance.manager.ApplianceManager()
+    for app_id in set([a if isinstance(a, str) else a.id for a in apps]):
+      app_mgr.invalidate_appliance(app_id)
+
+  def _is_stale(self, contr, ttl, cur_time):
+    """
+    Checks whether the container state needs to be refreshed from upstream. If `ttl` is
+    not given, services are kept fresh by the Marathon event stream and served from the
+    database for `state_ttl` seconds while the stream of the leader is connected, whereas
+    jobs are always refreshed.
+
+    """
+    if ttl is None:
+      ttl = config.marathon.state_ttl \
+        if contr.type == ContainerType.SERVICE and self.__event_monitor.is_connected else 0
+    return not contr.last_update or cur_time - contr.last_update > timedelta(seconds=ttl)
 
   async def _get_updated_container(self, contr):
     assert isinstance(contr, Container)
     self.logger.debug('Update container info: %s'%contr)
     if contr.type == ContainerType.SERVICE:
-      status, raw_service, err = await self.__service_api.get_service_update(contr)
-      if not err:
-        parsed_srv = await self._parse_service_state(raw_service)
-        contr.state, contr.endpoints = parsed_srv['state'], parsed_srv['endpoints']
-        contr.deployment = parsed_srv['deployment']
+      status, raw_contr, err = await self.__service_api.get_service_update(contr)
     elif contr.type == ContainerType.JOB:
-      status, raw_job, err = await self.__job_api.get_job_update(contr)
-      if not err:
-        parsed_job = await self._parse_job_state(raw_job)
-        contr.state, contr.deployment = parsed_job['state'], parsed_job['deployment']
+      status, raw_contr, err = await self.__job_api.get_job_update(contr)
     else:
       err = "Unknown container type: %s"%contr.type
       self.logger.warn(err)
       return 400, None, err
+    if not err:
+      await self._update_container_state(contr, raw_contr)
+    return status, contr, err
+
+  async def _get_updated_containers(self, contrs):
+    """
+    Refreshes the containers with one bulk query per upstream (Marathon, Chronos and Mesos)
+    and joins the results in memory, so that the number of upstream calls does not grow
+    with the number of containers. Falls back to per-container refreshes for the container
+    type whose bulk query fails, and for the containers missing from the bulk results.
+
+    :param contrs: list of container.Container
+    :return: list of (status, container.Container, error) in the same order as `contrs`
+
+    """
+    if not contrs:
+      return []
+    app_ids = set(c.appliance for c in contrs)
+    app_id = app_ids.pop() if len(app_ids) == 1 else None
+    reqs = {}
+    if any(c.type == ContainerType.SERVICE for c in contrs):
+      reqs[ContainerType.SERVICE] = self.__service_api.get_service_updates(app_id)
+    if any(c.type == ContainerType.JOB for c in contrs):
+      reqs[ContainerType.JOB] = self.__job_api.get_job_updates(app_id)
+    resps = await multi(reqs)
+    for type, (status, _, err) in resps.items():
+      if status != 200:
+        self.logger.warning('Failed to query %ss in bulk, '
+                            'fall back to per-container queries: %s'%(type.value, err))
+    results, fallbacks = [None] * len(contrs), []
+    for i, c in enumerate(contrs):
+      status, raw_contrs, err = resps.get(c.type, (400, None, None))
+      if status != 200:
+        fallbacks += i,
+        continue
+      raw_contr = raw_contrs.get(str(c))
+      if raw_contr is None:
+        # the bulk results may be truncated, so only the per-container query is trusted to
+        # tell that the container no longer exists
+        fallbacks += i,
+        continue
+      await self._update_container_state(c, raw_contr)
+      results[i] = 200, c, None
+    # per-container queries are fanned out concurrently, bounded per upstream by the API managers
+    resps = await multi([self._get_updated_container(contrs[i]) for i in fallbacks])
+    for i, resp in zip(fallbacks, resps):
+      results[i] = resp
+    return results
+
+  async def _update_container_state(self, contr, raw_contr):
+    prev_state = contr.state
+    if contr.type == ContainerType.SERVICE:
+      parsed_srv = await self._parse_service_state(raw_contr)
+      contr.state, contr.endpoints = parsed_srv['state'], parsed_srv['endpoints']
+      contr.deployment = parsed_srv['deployment']
+    elif contr.type == ContainerType.JOB:
+      parsed_job = await self._parse_job_state(raw_contr)
+      contr.state, contr.deployment = parsed_job['state'], parsed_job['deployment']
     # add descriptive names to the endpoints
     for i, p in enumerate(contr.ports):
       if i >= len(contr.endpoints): break
       contr.endpoints[i].name = p.name
-    return status, contr, err
+    if contr.state != prev_state:
+      self._notify_state_change(contr)
+
+  def _notify_state_change(self, contr):
+    for listener in self.__state_listeners:
+      try:
+        listener(contr)
+      except Exception as e:
+        self.logger.error(str(e))
 
   async def _parse_service_state(self, body):
     if isinstance(body, str):
@@ -183,11 +324,11 @@ class ContainerManager(Manager):
     # parse endpoints
     endpoints, deployment = [], ContainerDeployment()
     if state == ContainerState.RUNNING:
+      cluster = await self.__cluster_mgr.get_snapshot()
       for t in tasks:
         # parse endpoints
-        hosts = await self.__cluster_db.find_agents(hostname=t['host'])
-        if not hosts: continue
-        host = hosts[0]
+        host = cluster.get_agent_by_hostname(t['host'])
+        if not host: continue
         hostname = host.attributes.get('fqdn') or host.attributes.get('public_ip')
         if not hostname:
           continue
@@ -234,13 +375,12 @@ class ContainerManager(Manager):
                                                                ContainerState.SUBMITTED)
     if res['state'] == ContainerState.SUCCESS and get_n_repeats(body['schedule']) != 0:
       res['state'] = ContainerState.RUNNING
-    hosts = await self.__cluster_db.find_agents(id=task.get('slave_id'))
-    if not hosts:
+    host = (await self.__cluster_mgr.get_snapshot()).get_agent(task.get('slave_id'))
+    if not host:
       if task.get('slave_id'):
         self.logger.warning('Unrecognized agent ID: %s'%task.get('slave_id'))
       res.update(state=ContainerState.PENDING)
       return res
-    host = hosts[0]
     deployment.placement.host = host.hostname
     deployment.cloud = host.attributes.get('cloud')
     deployment.region = host.attributes.get('region')
@@ -253,11 +393,13 @@ class ServiceAPIManager(APIManager):
 
   def __init__(self):
     super(ServiceAPIManager, self).__init__()
+    self.__marathon_sem = Semaphore(config.marathon.max_concurrency)
 
   async def get_service_update(self, service):
     api = config.marathon
     endpoint = '%s/apps%s'%(api.endpoint, service)
-    status, body, err = await self.http_cli.get(api.host, api.port, endpoint)
+    async with self.__marathon_sem:
+      status, body, err = await self.http_cli.get(api.host, api.port, endpoint)
     if status == 404:
       return status, service, "Service '%s' is not found"%service
     if status != 200:
@@ -265,6 +407,31 @@ class ServiceAPIManager(APIManager):
       return status, service, err
     return status, body, err
 
+  async def get_service_updates(self, app_id=None):
+    """
+    Fetches the services of the appliance, or of all the appliances if `app_id` is not
+    given, along with their tasks in a single Marathon query
+
+    :return: dict of Marathon app bodies keyed by service path, e.g., "/app/service"
+
+    """
+    api = config.marathon
+    endpoint = '%s/apps?embed=apps.tasks&embed=apps.counts'%api.endpoint
+    prefix = '/%s/'%app_id if app_id else '/'
+    if app_id:
+      endpoint += '&id=%s'%url_escape(prefix)
+    status, body, err = await self.http_cli.get(api.host, api.port, endpoint)
+    if status != 200:
+      self.logger.debug(err)
+      return status, None, err
+    return status, {a['id']: dict(app=a) for a in body['apps'] if a['id'].startswith(prefix)}, None
+
+  async def subscribe_events(self, event_types, streaming_callback, handle=None):
+    api = config.marathon
+    endpoint = '%s/events?%s'%(api.endpoint, '&'.join('event_type=%s'%e for e in event_types))
+    return await self.http_cli.stream(api.host, api.port, endpoint, streaming_callback,
+                                      handle=handle, Accept='text/event-stream')
+
   async def provision_service(self, service):
     api = config.marathon
     endpoint = '%s/apps?force=true'%api.endpoint
@@ -279,13 +446,18 @@ class ServiceAPIManager(APIManager):
 
 class JobAPIManager(APIManager):
 
+  MESOS_TASK_QUERY_LIMIT = 10000
+
   def __init__(self):
     super(JobAPIManager, self).__init__()
+    self.__chronos_sem = Semaphore(config.chronos.max_concurrency)
+    self.__mesos_sem = Semaphore(config.mesos.max_concurrency)
 
   async def get_job_update(self, job):
     chronos = config.chronos
     endpoint = '%s/job/%s'%(chronos.endpoint, job)
-    status, body, err = await self.http_cli.get(chronos.host, chronos.port, endpoint)
+    async with self.__chronos_sem:
+      status, body, err = await self.http_cli.get(chronos.host, chronos.port, endpoint)
     if err:
       return status, None, err
     task_id = body['taskId']
@@ -294,12 +466,53 @@ class JobAPIManager(APIManager):
       return status, job, None
     mesos = config.mesos
     endpoint = '%s/tasks?task_id=%s'%(mesos.endpoint, task_id)
-    status, body, err = await self.http_cli.get(mesos.host, mesos.port, endpoint)
+    async with self.__mesos_sem:
+      status, body, err = await self.http_cli.get(mesos.host, mesos.port, endpoint)
     if err:
       return status, None, err
     job['task'] = body['tasks'][0] if body['tasks'] else None
     return status, job, None
 
+  async def get_job_updates(self, app_id=None):
+    """
+    Fetches the jobs of the appliance, or of all the appliances if `app_id` is not given,
+    with a single Chronos query, and their latest tasks with a single Mesos query. Chronos
+    job search is paginated, hence all the jobs are listed and filtered locally. Jobs whose
+    tasks are beyond the Mesos query limit are left out, so that they are refreshed
+    individually.
+
+    :return: dict of job states keyed by job name, e.g., "app.job"
+
+    """
+    chronos = config.chronos
+    prefix = '%s.'%app_id if app_id else ''
+    endpoint = '%s/jobs'%chronos.endpoint
+    status, body, err = await self.http_cli.get(chronos.host, chronos.port, endpoint)
+    if err:
+      return status, None, err
+    jobs, task_ids = {}, {}
+    for j in body:
+      if not j['name'].startswith(prefix):
+        continue
+      appliance, _, id = j['name'].partition('.')
+      jobs[j['name']] = dict(id=id, appliance=appliance, schedule=j['schedule'])
+      if j.get('taskId'):
+        task_ids[j['name']] = j['taskId']
+    if not task_ids:
+      return 200, jobs, None
+    mesos = config.mesos
+    endpoint = '%s/tasks?limit=%d'%(mesos.endpoint, self.MESOS_TASK_QUERY_LIMIT)
+    status, body, err = await self.http_cli.get(mesos.host, mesos.port, endpoint)
+    if err:
+      return status, None, err
+    tasks = {t['id']: t for t in body['tasks']}
+    for name, task_id in task_ids.items():
+      if task_id in tasks:
+        jobs[name]['task'] = tasks[task_id]
+      else:
+        del jobs[name]
+    return 200, jobs, None
+
   async def provision_job(self, job):
     api = config.chronos
     endpoint = '%s/iso8601'%api.endpoint
@@ -317,11 +530,138 @@ class JobAPIManager(APIManager):
     return await self.http_cli.delete(api.host, api.port, endpoint)
 
 
+class ServiceEventMonitor(AutonomousMonitor):
+  """
+  Subscribes to the Marathon event stream and refreshes the services whose tasks, health
+  checks or deployments have changed. The subscription is re-established on the next tick
+  whenever the stream is closed.
+
+  Only the leader subscribes. It records in the database whether its stream is connected,
+  so that the other processes know whether the services are kept fresh.
+
+  """
+
+  EVENT_TYPES = ('status_update_event', 'health_status_changed_event',
+                 'deployment_info', 'deployment_success', 'deployment_failed')
+
+  def __init__(self, interval=5000, flush_delay=.5):
+    super(ServiceEventMonitor, self).__init__(interval)
+    self.__api = ServiceAPIManager()
+    self.__status_db = EventStreamDBManager()
+    self.__interval = interval
+    self.__flush_delay = flush_delay
+    self.__is_subscribed = False
+    self.__is_connected = False
+    self.__stream = None
+    self.__buf = b''
+    self.__changed = set()
+    # until when the stream of the leader is known to be connected, and when that was read
+    self.__expire_at, self.__synced_at = 0, 0
+
+  @property
+  def is_connected(self):
+    return self.__is_connected or time.time() < self.__expire_at
+
+  async def sync(self):
+    """
+    Reads whether the stream of the leader is connected, at most once per interval
+
+    """
+    now = time.time()
+    if self.__is_subscribed or now - self.__synced_at < self.__interval/1000:
+      return
+    self.__synced_at = now
+    try:
+      self.__expire_at = await self.__status_db.get_expiry('marathon')
+    except Exception as e:
+      self.logger.error(str(e))
+
+  def stop(self):
+    super(ServiceEventMonitor, self).stop()
+    if self.__stream:
+      self.__stream.close()
+    self.__stream, self.__buf = None, b''
+    self.__is_subscribed = self.__is_connected = False
+    IOLoop.current().add_callback(self._save_status)
+
+  async def callback(self):
+    if self.__is_subscribed:
+      if self.__is_connected:
+        await self._save_status()
+      return
+    self.__is_subscribed, self.__buf = True, b''
+    self.__stream = stream = HTTPStream()
+    try:
+      status, _, err = await self.__api.subscribe_events(self.EVENT_TYPES,
+                                                         partial(self._on_chunk, stream),
+                                                         stream)
+      self.logger.warning('Marathon event stream is closed: %s'%(err or status))
+    finally:
+      # the monitor may have been stopped and restarted with a new stream in the meantime
+      if stream is self.__stream:
+        self.__stream = None
+        self.__is_subscribed = self.__is_connected = False
+        await self._save_status()
+
+  def _on_chunk(self, stream, chunk):
+    if stream is not self.__stream:
+      raise Exception('Marathon event stream is closed')
+    if not self.__is_connected:
+      self.logger.info('Subscribed to the Marathon event stream')
+      self.__is_connected = True
+      IOLoop.current().add_callback(self._save_status)
+    # events are only decoded once complete, as a chunk may end in the middle of a character
+    self.__buf = (self.__buf + chunk).replace(b'\r\n', b'\n')
+    *events, self.__buf = self.__buf.split(b'\n\n')
+    for e in events:
+      self._on_event(e.decode('utf-8'))
+
+  async def _save_status(self):
+    # the status outlives a few missed ticks of the leader, but not its failure
+    expire_at = time.time() + self.__interval * 3/1000 if self.__is_connected else 0
+    try:
+      await self.__status_db.save_expiry('marathon', expire_at)
+    except Exception as e:
+      self.logger.error(str(e))
+
+  def _on_event(self, raw_event):
+    data = '\n'.join(l[5:].lstrip() for l in raw_event.split('\n') if l.startswith('data:'))
+    if not data:
+      return
+    try:
+      data = json.loads(data)
+    except json.JSONDecodeError as e:
+      self.logger.error('Malformed Marathon event: %s'%e)
+      return
+    app_ids = set([data['appId']] if 'appId' in data else [])
+    for step in data.get('plan', {}).get('steps', []):
+      app_ids.update(a['app'] for a in step.get('actions', []) if 'app' in a)
+    if '/sys/chronos' in app_ids:
+      ClusterManager().invalidate_chronos()
+    # only services of appliances, i.e., "/<appliance>/<service>", are tracked
+    app_ids = set(a for a in app_ids if a.count('/') == 2 and not a.startswith('/sys/'))
+    if not app_ids:
+      return
+    if not self.__changed:
+      IOLoop.current().call_later(self.__flush_delay, self._flush)
+    self.__changed.update(app_ids)
+
+  async def _flush(self):
+    app_ids, self.__changed = self.__changed, set()
+    contr_mgr = ContainerManager()
+    await multi([contr_mgr.get_container(*a.strip('/').split('/'), ttl=0) for a in app_ids])
+
+
 class ContainerDBManager(Manager):
 
   def __init__(self):
     self.__contr_col = MongoClient()[config.db.name].container
 
+  async def ensure_indexes(self):
+    await self.__contr_col.create_indexes([IndexModel([('appliance', 1), ('id', 1)], unique=True),
+                                           IndexModel([('appliance', 1), ('type', 1)]),
+                                           IndexModel('deployment.ip_addresses')])
+
   async def get_container_by_virtual_ip_address(self, ip_addr):
     return await self._get_container(**{'deployment.ip_addresses': ip_addr})
 
@@ -331,10 +671,21 @@ class ContainerDBManager(Manager):
   async def get_containers(self, **filters):
     return [Container.parse(c, False)[1] async for c in self.__contr_col.find(filters)]
 
+  async def get_container_summaries(self, **filters):
+    return [ContainerSummary(**c)
+            async for c in self.__contr_col.find(filters, ContainerSummary.PROJECTION)]
+
   async def save_container(self, contr, upsert=True):
     await self.__contr_col.replace_one(dict(id=contr.id, appliance=contr.appliance),
                                        contr.to_save(), upsert=upsert)
 
+  async def save_containers(self, contrs, upsert=True):
+    if not contrs:
+      return
+    await self.__contr_col.bulk_write([ReplaceOne(dict(id=c.id, appliance=c.appliance),
+                                                  c.to_save(), upsert=upsert)
+                                       for c in contrs], ordered=False)
+
   async def delete_container(self, contr):
     await self.__contr_col.delete_one(dict(id=contr.id, appliance=contr.appliance))
     return 200, "Container '%s' has been deleted"%contr, None
@@ -348,3 +699,20 @@ class ContainerDBManager(Manager):
     if not contr:
       return 404, None, "Container matching '%s' is not found"%filters
     return Container.parse(contr, False)
+
+
+class EventStreamDBManager(Manager):
+
+  def __init__(self):
+    self.__status_col = MongoClient()[config.db.name].event_stream
+
+  async def ensure_indexes(self):
+    await self.__status_col.create_indexes([IndexModel('id', unique=True)])
+
+  async def get_expiry(self, stream_id):
+    status = await self.__status_col.find_one(dict(id=stream_id))
+    return status['expire_at'] if status else 0
+
+  async def save_expiry(self, stream_id, expire_at):
+    await self.__status_col.update_one(dict(id=stream_id),
+                                       {'$set': dict(expire_at=expire_at)}, upsert=True)
@@ -160,6 +160,9 @@ class Service(Container):
 
   """
 
+  __slots__ = ('__instances', '__health_check', '__default_health_check',
+               '__minimum_capacity', )
+
   def __init__(self, instances=1, health_check=None, default_health_check=False,
                minimum_capacity=0, *args, **kwargs):
     super(Service, self).__init__(*args, **kwargs)
@@ -1,47 +1,186 @@
+import copy
+import time
+
 import appliance
+import container.manager
 import volume
 
 from abc import ABCMeta
-from itertools import groupby
+from tornado.gen import multi
+from tornado.ioloop import IOLoop, PeriodicCallback
+from pymongo import ReturnDocument, IndexModel
 
 from schedule import SchedulePlan
 from schedule.universal import GlobalScheduleExecutor
-from commons import AutonomousMonitor, Loggable
-from config import get_global_scheduler
+from commons import MongoClient, AutonomousMonitor, Manager, Loggable, Singleton
+from commons import get_process_id
+from config import config, get_global_scheduler
 from locality import Placement
+from cluster import LocalityTree
+from cluster.manager import ClusterManager
+
+
+class ApplianceScheduleExecutor(Loggable, metaclass=Singleton):
+  """
+  Schedules appliances from one shared loop per process. Pending appliances are kept in a
+  queue persisted in MongoDB, so that any worker process of any PIVOT replica can claim
+  them, including those submitted before a restart. A claimed appliance is leased to the
+  claiming process, which renews the lease on every tick and three times per `lease_ttl`
+  while scheduling them; appliances whose lease has expired can be claimed by other
+  processes.
 
+  Appliances are due either when the state of one of their containers changes or after
+  `recheck_interval` seconds. On every tick the cluster is fetched once and shared by a
+  batch of at most `batch_size` due appliances, whose placements are taken off it in turn.
 
-class ApplianceScheduleExecutor(AutonomousMonitor):
+  """
 
-  def __init__(self, app_id, scheduler, interval=3000):
-    super(ApplianceScheduleExecutor, self).__init__(interval)
-    self.__app_id = app_id
+  def __init__(self, interval=config.schedule.interval,
+               batch_size=config.schedule.batch_size,
+               recheck_interval=config.schedule.recheck_interval,
+               lease_ttl=config.schedule.lease_ttl):
+    super(ApplianceScheduleExecutor, self).__init__()
+    self.__batch_size = batch_size
+    self.__recheck_interval = recheck_interval
+    self.__lease_ttl = lease_ttl
     self.__app_mgr = appliance.manager.ApplianceManager()
-    self.__local_sched = scheduler
     self.__global_sched_exec = GlobalScheduleExecutor(get_global_scheduler())
+    self.__queue = ScheduleQueueDBManager()
+    self.__schedulers = {}
+    self.__is_busy = False
+    self.__runner = ApplianceScheduleRunner(self, int(interval * 1000))
+    container.manager.ContainerManager().add_state_listener(
+      lambda c: self.wake(c.appliance if isinstance(c.appliance, str) else c.appliance.id))
 
-  async def callback(self):
-    # get appliance
-    status, app, err = await self.__app_mgr.get_appliance(self.__app_id)
+  def start(self):
+    self.__runner.start()
+
+  async def submit(self, app_id, scheduler=None):
+    """
+
+    :param app_id: str
+    :param scheduler: schedule.local.ApplianceScheduler
+
+    """
+    if scheduler:
+      self.__schedulers[app_id] = scheduler
+    await self.__queue.enqueue(app_id, time.time())
+
+  def wake(self, app_id, delay=0):
+    IOLoop.current().spawn_callback(self.__queue.set_due, app_id, time.time() + delay)
+
+  async def remove(self, app_id):
+    self.__schedulers.pop(app_id, None)
+    await self.__queue.dequeue(app_id)
+
+  async def run(self):
+    if self.__is_busy:
+      return
+    self.__is_busy = True
+    try:
+      now, owner = time.time(), get_process_id()
+      await self._renew_leases()
+      app_ids = await self.__queue.claim(owner, now, now + self.__lease_ttl,
+                                         now + self.__recheck_interval, self.__batch_size)
+      if not app_ids:
+        return
+      # a tick may outlast the leases, e.g., when placements are solved or many containers
+      # are provisioned
+      renewer = PeriodicCallback(self._renew_leases, self.__lease_ttl * 1000/3)
+      renewer.start()
+      try:
+        agents = list(await self.__global_sched_exec.get_agents())
+        await multi([self._schedule(app_id, agents) for app_id in app_ids])
+      finally:
+        renewer.stop()
+    finally:
+      self.__is_busy = False
+
+  async def _schedule(self, app_id, agents):
+    status, app, err = await self.__app_mgr.get_appliance(app_id)
     if not app:
       if status == 404:
-        self.logger.info("Appliance '%s' no longer exists"%self.__app_id)
+        self.logger.info("Appliance '%s' no longer exists"%app_id)
+        await self.remove(app_id)
       else:
         self.logger.error(err)
-      self.stop()
       return
-    # get cluster info
-    agents = await self.__global_sched_exec.get_agents()
+    # the appliance is shared through the cache, while the schedulers write into its
+    # containers and volumes
+    app = copy.deepcopy(app)
+    if app_id not in self.__schedulers:
+      self.__schedulers[app_id] = self.__app_mgr.get_scheduler(app.scheduler)
+      self.logger.info("Resumed scheduling appliance '%s'"%app_id)
     # contact the scheduler for new schedule
-    sched = await self.__local_sched.schedule(app, list(agents))
-    self.logger.debug('Containers to be scheduled: %s'%[c.id for c in sched.containers])
+    sched = await self.__schedulers[app_id].schedule(app, list(agents))
+    self.tick_logger.debug('Containers to be scheduled: %s'%[c.id for c in sched.containers])
     # if the scheduling is done
     if sched.done:
-      self.logger.info('Scheduling is done for appliance %s'%self.__app_id)
-      self.stop()
+      self.logger.info('Scheduling is done for appliance %s'%app_id)
+      await self.remove(app_id)
       return
-    # execute the new schedulex
-    await self.__global_sched_exec.submit(sched)
+    # execute the new schedule
+    await self.__global_sched_exec.submit(sched, agents)
+
+  async def _renew_leases(self):
+    await self.__queue.renew_leases(get_process_id(), time.time() + self.__lease_ttl)
+
+
+class ApplianceScheduleRunner(AutonomousMonitor):
+
+  def __init__(self, executor, interval=1000):
+    super(ApplianceScheduleRunner, self).__init__(interval)
+    self.__executor = executor
+
+  async def callback(self):
+    await self.__executor.run()
+
+
+class ScheduleQueueDBManager(Manager):
+  """
+  Queue of the appliances pending scheduling. Each entry records when the appliance is
+  `due`, the process that `owner`s it and until when the ownership is leased.
+
+  """
+
+  def __init__(self):
+    self.__queue_col = MongoClient()[config.db.name].schedule_queue
+
+  async def ensure_indexes(self):
+    await self.__queue_col.create_indexes([IndexModel('id', unique=True),
+                                           IndexModel([('due', 1), ('owner', 1)]),
+                                           IndexModel('owner')])
+
+  async def enqueue(self, app_id, due):
+    await self.__queue_col.update_one(dict(id=app_id),
+                                      {'$set': dict(due=due, owner=None, lease=0)},
+                                      upsert=True)
+
+  async def dequeue(self, app_id):
+    await self.__queue_col.delete_one(dict(id=app_id))
+
+  async def set_due(self, app_id, due):
+    await self.__queue_col.update_one(dict(id=app_id), {'$min': dict(due=due)})
+
+  async def renew_leases(self, owner, lease):
+    await self.__queue_col.update_many(dict(owner=owner), {'$set': dict(lease=lease)})
+
+  async def claim(self, owner, now, lease, next_due, limit):
+    """
+    Claims at most `limit` due entries that are either owned by `owner` or whose lease has
+    expired, and postpones them to `next_due`
+
+    """
+    app_ids = []
+    while len(app_ids) < limit:
+      entry = await self.__queue_col.find_one_and_update(
+        {'due': {'$lte': now}, '$or': [dict(owner=owner), {'lease': {'$lt': now}}]},
+        {'$set': dict(owner=owner, lease=lease, due=next_due)},
+        sort=[('due', 1)], return_document=ReturnDocument.AFTER)
+      if not entry:
+        break
+      app_ids += entry['id'],
+    return app_ids
 
 
 class ApplianceScheduler(Loggable, metaclass=ABCMeta):
@@ -63,6 +202,7 @@ class ApplianceScheduler(Loggable, metaclass=ABCMeta):
 
 
 from container import ContainerState, ContainerType, ContainerVolumeType
+from container.service import Service
 
 
 class DefaultApplianceScheduler(ApplianceScheduler):
@@ -84,14 +224,14 @@ class DefaultApplianceScheduler(ApplianceScheduler):
     """
     sched = SchedulePlan()
     free_contrs = self.resolve_dependencies(app)
-    self.logger.info('Free containers: %s'%[c.id for c in free_contrs])
+    self.tick_logger.info('Free containers: %s'%[c.id for c in free_contrs])
     if not free_contrs:
       sched.done = True
       return sched
     contrs_to_create = [c for c in free_contrs
                         if c.state in (ContainerState.SUBMITTED, ContainerState.FAILED)]
     for c in contrs_to_create:
-      c.sys_schedult_hints = c.user_schedule_hints
+      c.sys_schedule_hints = c.user_schedule_hints
     vols_declared = {v.id: v for v in app.volumes}
     vols_to_create = set([v.src for c in contrs_to_create for v in c.persistent_volumes
                           if v.type == ContainerVolumeType.PERSISTENT
@@ -112,28 +252,34 @@ class DefaultApplianceScheduler(ApplianceScheduler):
       parents.setdefault(c.id, set()).update([d for d in c.dependencies if d in contrs])
     return [contrs[k] for k, v in parents.items() if not v]
 
-  def find_placement(self, contrs, agents):
-    import container
+  async def find_placement(self, contrs, agents=None):
+    """
+    Finds the narrowest locality, from host up to cloud, that has enough free resources of
+    every kind for all the containers
+
+    :param contrs: list of container.Container
+    :param agents: cluster.LocalityTree, or list of cluster.Agent. If not given, the
+                   locality tree maintained by the cluster manager is used.
+    :return: locality.Placement
+
+    """
+    if agents is None:
+      tree = await ClusterManager().get_locality_tree()
+    else:
+      tree = agents if isinstance(agents, LocalityTree) else LocalityTree(agents)
+    demand = dict(cpus=0, mem=0, disk=0, gpus=0)
+    for c in contrs:
+      n = c.instances if isinstance(c, Service) else 1
+      r = c.resources
+      demand['cpus'] += r.cpus * n
+      demand['mem'] += r.mem * n
+      demand['disk'] += r.disk * n
+      demand['gpus'] += r.gpu * n
     placement = Placement()
-    cpus_demanded = sum([(c.resources.cpus * c.instances
-                          if isinstance(c, container.service.Service) else c.resources.cpus)
-                         for c in contrs])
     for locality in ('host', 'zone', 'region', 'cloud', ):
-      agents = list(sorted(agents, key=lambda a: a.attributes[locality]))
-      key, cpus_avail = max([(k, sum([a.resources.cpus for a in group]))
-                             for k, group in groupby(agents, lambda a: a.attributes[locality])],
-                            key=lambda x: x[1])
-      self.logger.info('locality: %s, value: %s, '
-                       'CPU available: %.1f, CPU demanded: %.1f'%(locality, key, cpus_avail, cpus_demanded))
-      if cpus_avail >= cpus_demanded:
-        if locality == 'host':
-          placement.host = key
-        elif locality == 'zone':
-          placement.zone = key
-        elif locality == 'region':
-          placement.region = key
-        elif locality == 'cloud':
-          placement.region = key
+      node = tree.find(locality, **demand)
+      self.tick_logger.info('locality: %s, node: %s, demanded: %s'%(locality, node, demand))
+      if node:
+        setattr(placement, locality, node[0])
         break
     return placement
-
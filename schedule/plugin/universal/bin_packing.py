@@ -0,0 +1,184 @@
+import numpy as np
+
+from container import ContainerScheduleHints
+from container.service import Service
+from locality import Placement
+from schedule import SchedulePlan
+from schedule.universal import GlobalScheduler
+
+
+class BinPackingGlobalScheduler(GlobalScheduler):
+  """
+  Multi-resource bin packing of containers onto agents. The free cpus, mem, disk and gpus
+  of all the agents are held in a matrix, and every container is scored against all the
+  agents at once. Containers are placed in decreasing order of their demand, each onto the
+  best-fitting agent, i.e., the one that is left with the least free resources normalized
+  by the largest free amount of each resource in the cluster. The chosen host is written
+  into the placement of the system schedule hints of the container.
+
+  Containers already placed on a host are left untouched, but their demand is taken off
+  the host. Containers placed on a zone, region or cloud only land on agents there, and
+  all containers only land on agents with the matching `preemptible` attribute, as in the
+  constraints sent to Marathon and Chronos. Containers that fit on no agent are left
+  unplaced.
+
+  Requires NumPy. If it is not installed, the default global scheduler is used instead.
+
+  """
+
+  LOCALITIES = ('zone', 'region', 'cloud', )
+
+  async def schedule(self, sched, agents):
+    """
+
+    :param sched: schedule.SchedulePlan
+    :param agents: list of cluster.Agent
+    :return: schedule.SchedulePlan
+
+    """
+    agents = list(agents)
+    if not agents or not sched.containers:
+      return sched
+    placed = self.place(sched.containers, agents)
+    self.tick_logger.info('Placed %d/%d containers on %d agents'%(placed,
+                                                                 len(sched.containers),
+                                                                 len(agents)))
+    return sched
+
+  async def reschedule(self, contrs, agents):
+    return SchedulePlan()
+
+  def place(self, contrs, agents):
+    """
+    Places the containers onto the agents in place
+
+    :param contrs: list of container.Container
+    :param agents: list of cluster.Agent
+    :return: int, the number of containers placed
+
+    """
+    free, demands, order, eligible = self.formulate(contrs, agents)
+    hosts = self.pack(free, demands, order, eligible)
+    self.assign(contrs, agents, hosts)
+    return len(hosts)
+
+  def formulate(self, contrs, agents):
+    """
+    Formulates the placement of the containers onto the agents
+
+    :param contrs: list of container.Container
+    :param agents: list of cluster.Agent
+    :return: tuple of the free resources of the agents, one row per resource and one
+             column per agent, the demands of the containers, one row per container, the
+             indices of the containers to place in decreasing order of their demand, and
+             the mask of the agents eligible for each of them regardless of resources
+
+    """
+    # one row per resource, so that every comparison and reduction runs over contiguous memory
+    free = np.array([[a.resources.cpus for a in agents], [a.resources.mem for a in agents],
+                     [a.resources.disk for a in agents], [a.resources.gpus for a in agents]],
+                    dtype=np.float64)
+    host_idx = {a.hostname: i for i, a in enumerate(agents)}
+    attrs, masks = {}, {}
+
+    def get_mask(attr, val):
+      key = attr, str(val).lower()
+      if key not in masks:
+        if attr not in attrs:
+          attrs[attr] = np.array([str(a.attributes.get(attr, '')).lower() for a in agents],
+                                 dtype=object)
+        masks[key] = attrs[attr] == key[1]
+      return masks[key]
+
+    demands = np.array([self._get_demand(c) for c in contrs], dtype=np.float64)
+    eligible = {}
+    for i, c in enumerate(contrs):
+      hints = c.sys_schedule_hints
+      if hints.placement.host:
+        if hints.placement.host in host_idx:
+          free[:, host_idx[hints.placement.host]] -= demands[i]
+        continue
+      eligible[i] = get_mask('preemptible', hints.preemptible)
+      for l in self.LOCALITIES:
+        if getattr(hints.placement, l):
+          eligible[i] = eligible[i] & get_mask(l, getattr(hints.placement, l))
+          break
+    scale = np.maximum(free.max(axis=1), 1.)
+    order = sorted(eligible, key=lambda i: -(demands[i]/scale).sum())
+    return free, demands, order, eligible
+
+  def pack(self, free, demands, order, eligible):
+    """
+    Packs the containers greedily in the given order
+
+    :return: dict of the indices of the placed containers to those of their agents
+
+    """
+    free, hosts = free.copy(), {}
+    scale = np.maximum(free.max(axis=1), 1.)
+    for i in order:
+      demand = demands[i]
+      feasible = eligible[i].copy()
+      for r, d in enumerate(demand):
+        if d > 0:
+          feasible &= free[r] >= d
+      if not feasible.any():
+        continue
+      idx = int(np.argmin(np.where(feasible, self.score(free, demand, scale), np.inf)))
+      free[:, idx] -= demand
+      hosts[i] = idx
+    return hosts
+
+  def assign(self, contrs, agents, hosts):
+    """
+    Writes the hosts into the placement of the containers
+
+    :param hosts: dict of the indices of the placed containers to those of their agents
+
+    """
+    for i, c in enumerate(contrs):
+      hints = c.sys_schedule_hints
+      if hints.placement.host:
+        continue
+      if i not in hosts:
+        self.tick_logger.info("No agent can accommodate container '%s'"%c)
+        continue
+      # the system hints may be shared with the user's, hence replaced rather than updated
+      c.sys_schedule_hints = ContainerScheduleHints(
+        placement=Placement(**dict(hints.placement.to_save(), host=agents[hosts[i]].hostname)),
+        preemptible=hints.preemptible)
+
+  def score(self, free, demand, scale):
+    """
+    Scores all the agents for a container, the lower the better
+
+    :param free: numpy.ndarray, free resources of the agents, one row per resource and one
+                 column per agent
+    :param demand: numpy.ndarray, demanded resources of the container
+    :param scale: numpy.ndarray, normalizing factor of each resource
+    :return: numpy.ndarray, one score per agent
+
+    """
+    weights = 1./scale
+    return weights @ free - demand @ weights
+
+  def _get_demand(self, contr):
+    r = contr.resources
+    n = contr.instances if isinstance(contr, Service) else 1
+    return r.cpus * n, r.mem * n, r.disk * n, r.gpu * n
+
+
+class DominantResourceGlobalScheduler(BinPackingGlobalScheduler):
+  """
+  Bin packing that places each container onto the agent on which the container takes the
+  largest share of the agent's free amount of its dominant resource, i.e., the resource it
+  demands the most of relative to what is left on the agent
+
+  """
+
+  def score(self, free, demand, scale):
+    demanded = demand > 0
+    if not demanded.any():
+      return np.zeros(free.shape[1])
+    with np.errstate(divide='ignore'):
+      return -(demand[demanded, None]/free[demanded]).max(axis=0)
@@ -0,0 +1,206 @@
+import os
+import sys
+import time
+import datetime
+
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from tornado import gen
+from tornado.ioloop import IOLoop
+
+from config import config
+from schedule.plugin.universal.bin_packing import BinPackingGlobalScheduler
+
+
+class OptimalPlacementGlobalScheduler(BinPackingGlobalScheduler):
+  """
+  Placement that minimizes the fragmentation of the cluster. Among the placements that
+  place the most containers, it looks for the one using the fewest agents, and then the
+  fewest zones, by branch and bound over the containers and their eligible agents.
+
+  The solver is seeded with the greedy bin packing, and runs in a pool of `solver_workers`
+  processes within a wall-clock budget of `solver_budget` seconds, so as not to block the
+  IOLoop. The best placement found by the deadline is used, or the greedy one if the solver
+  does not return in time or fails. Solves are never queued: while all the workers are
+  busy, the greedy placement is used right away.
+
+  """
+
+  def __init__(self, budget=config.schedule.solver_budget,
+               workers=config.schedule.solver_workers):
+    super(OptimalPlacementGlobalScheduler, self).__init__()
+    self.__budget = budget
+    self.__workers = workers
+    self.__executor, self.__executor_pid = None, None
+    self.__n_solving = 0
+
+  async def schedule(self, sched, agents):
+    """
+
+    :param sched: schedule.SchedulePlan
+    :param agents: list of cluster.Agent
+    :return: schedule.SchedulePlan
+
+    """
+    agents, contrs = list(agents), sched.containers
+    if not agents or not contrs:
+      return sched
+    free, demands, order, eligible = self.formulate(contrs, agents)
+    hosts = self.pack(free, demands, order, eligible)
+    if self.__n_solving >= self.__workers:
+      self.tick_logger.info('All placement solvers are busy, fall back to greedy placement')
+      self.assign(contrs, agents, hosts)
+      return sched
+    # only the agents eligible for any of the containers are sent to the solver
+    agent_ids = sorted(set(a for i in order for a in eligible[i].nonzero()[0].tolist()))
+    local_ids = {a: j for j, a in enumerate(agent_ids)}
+    problem = dict(demands=[tuple(demands[i].tolist()) for i in order],
+                   free=[tuple(free[:, a].tolist()) for a in agent_ids],
+                   candidates=[[local_ids[a] for a in eligible[i].nonzero()[0].tolist()]
+                               for i in order],
+                   kinds=[self._get_kind(agents[a]) for a in agent_ids],
+                   seed=[local_ids[hosts[i]] if i in hosts else None for i in order])
+    try:
+      future = self._submit(problem)
+      # the solver stops itself by the deadline, allow it some time to return the result
+      assignment, is_optimal, n_nodes = await gen.with_timeout(
+        datetime.timedelta(seconds=self.__budget * 1.5 + 1), future)
+      hosts = {i: agent_ids[j] for i, j in zip(order, assignment) if j is not None}
+      self.tick_logger.info('Solved placement of %d containers on %d agents, optimal: %s, '
+                            'nodes explored: %d'%(len(order), len(agent_ids), is_optimal,
+                                                  n_nodes))
+    except gen.TimeoutError:
+      # a running solve cannot be interrupted, its worker stays busy until the deadline
+      future.cancel()
+      self.logger.warning('Placement solver timed out, fall back to greedy placement')
+    except Exception as e:
+      if isinstance(e, BrokenProcessPool):
+        self.__executor = None
+      self.logger.error('Placement solver failed, fall back to greedy placement: %s'%e)
+    self.assign(contrs, agents, hosts)
+    return sched
+
+  def _submit(self, problem):
+    """
+    Submits the problem to a worker, which is counted as busy until the solve returns,
+    rather than until the caller stops waiting for it
+
+    :return: concurrent.futures.Future
+
+    """
+    executor, io_loop = self._get_executor(), IOLoop.current()
+    future = executor.submit(solve, problem, self.__budget)
+    self.__n_solving += 1
+    # the callback runs in a thread of the pool
+    future.add_done_callback(lambda _: io_loop.add_callback(self._release))
+    return future
+
+  def _release(self):
+    self.__n_solving -= 1
+
+  def _get_executor(self):
+    # the pool is created lazily, i.e., after the server has forked its worker processes
+    if not self.__executor or self.__executor_pid != os.getpid():
+      if self.__executor_pid != os.getpid():
+        self.__n_solving = 0
+      self.__executor = ProcessPoolExecutor(self.__workers)
+      self.__executor_pid = os.getpid()
+    return self.__executor
+
+  def _get_kind(self, agent):
+    attrs = agent.attributes
+    return tuple(str(attrs.get(k, '')).lower() for k in ('preemptible', ) + self.LOCALITIES)
+
+
+class _Timeout(Exception):
+  pass
+
+
+def solve(problem, budget):
+  """
+  Finds the placement that places the most containers on the fewest agents, and then in
+  the fewest zones, by depth-first branch and bound. Agents already in use are tried first,
+  in best-fit order, and unused agents of the same kind with the same free resources are
+  interchangeable, hence only one of them is tried.
+
+  :param problem: dict of
+                  `demands`: list of resource tuples, one per container, in placement order
+                  `free`: list of resource tuples, one per agent
+                  `candidates`: list of indices of the eligible agents, one per container
+                  `kinds`: list of attribute tuples, i.e., preemptible, zone, region and
+                           cloud, one per agent
+                  `seed`: list of agent indices, or None if not placed, one per container
+  :param budget: float, wall-clock budget in seconds
+  :return: tuple of the best assignment found, whether it is proven optimal, and the
+           number of nodes explored
+
+  """
+  deadline = time.monotonic() + budget
+  demands, candidates, kinds = problem['demands'], problem['candidates'], problem['kinds']
+  n, n_res = len(demands), len(problem['free'][0]) if problem['free'] else 0
+  residual = [list(f) for f in problem['free']]
+  zones = [k[1:] for k in kinds]
+  # demand of the containers from the i-th on, to bound the number of agents still needed
+  remaining = [[0.] * n_res for _ in range(n + 1)]
+  for i in range(n - 1, -1, -1):
+    remaining[i] = [r + d for r, d in zip(remaining[i + 1], demands[i])]
+
+  def get_cost(assignment):
+    used = set(a for a in assignment if a is not None)
+    return (-(n - assignment.count(None)), len(used), len(set(zones[a] for a in used)))
+
+  best = list(problem['seed'])
+  best_cost = get_cost(best)
+  assignment, load, zone_load = [None] * n, {}, {}
+  used_residual = [0.] * n_res
+  n_nodes = 0
+
+  def search(i, n_placed):
+    nonlocal best, best_cost, n_nodes
+    n_nodes += 1
+    if not n_nodes & 1023 and time.monotonic() > deadline:
+      raise _Timeout()
+    n_agents = len(load)
+    if any(r > u for r, u in zip(remaining[i], used_residual)):
+      n_agents += 1
+    if (-(n_placed + n - i), n_agents, len(zone_load)) >= best_cost:
+      return
+    if i == n:
+      best, best_cost = list(assignment), get_cost(assignment)
+      return
+    d = demands[i]
+    fits = [a for a in candidates[i] if all(f >= x for f, x in zip(residual[a], d))]
+    fits.sort(key=lambda a: (a not in load, sum(f - x for f, x in zip(residual[a], d))))
+    tried = set()
+    for a in fits:
+      if a not in load:
+        key = kinds[a], tuple(residual[a])
+        if key in tried:
+          continue
+        tried.add(key)
+        used_residual[:] = [u + f for u, f in zip(used_residual, residual[a])]
+      residual[a] = [f - x for f, x in zip(residual[a], d)]
+      used_residual[:] = [u - x for u, x in zip(used_residual, d)]
+      load[a] = load.get(a, 0) + 1
+      zone_load[zones[a]] = zone_load.get(zones[a], 0) + 1
+      assignment[i] = a
+      search(i + 1, n_placed + 1)
+      assignment[i] = None
+      zone_load[zones[a]] -= 1
+      if not zone_load[zones[a]]:
+        del zone_load[zones[a]]
+      load[a] -= 1
+      used_residual[:] = [u + x for u, x in zip(used_residual, d)]
+      residual[a] = [f + x for f, x in zip(residual[a], d)]
+      if not load[a]:
+        del load[a]
+        used_residual[:] = [u - f for u, f in zip(used_residual, residual[a])]
+    search(i + 1, n_placed)
+
+  # the search recurses once per container, and only runs in the worker processes
+  sys.setrecursionlimit(max(sys.getrecursionlimit(), n + 100))
+  try:
+    search(0, 0)
+    return best, True, n_nodes
+  except _Timeout:
+    return best, False, n_nodes
@@ -3,8 +3,11 @@ import cluster.manager
 import volume.manager
 
 from tornado.gen import multi
+from tornado.locks import Lock
 
 from schedule import SchedulePlan
+from cluster import Agent, AgentResources
+from container import ContainerType
 from commons import AutonomousMonitor, Singleton, Loggable
 
 
@@ -31,27 +34,65 @@ class GlobalScheduleExecutor(Loggable, metaclass=Singleton):
     self.__contr_mgr = container.manager.ContainerManager()
     self.__cluster_mgr = cluster.manager.ClusterManager()
     self.__vol_mgr = volume.manager.VolumeManager()
+    self.__placement_lock = Lock()
     self.__resched_runner = RescheduleRunner(scheduler, self, interval)
 
   def start_rescheduler(self):
     self.__resched_runner.start()
 
-  async def submit(self, sched):
+  def stop_rescheduler(self):
+    self.__resched_runner.stop()
+
+  async def submit(self, sched, agents=None):
     """
 
     :param sched: schedule.SchedulePlan
+    :param agents: list of cluster.Agent, fetched from the cluster if not given. The
+                   resources of the containers placed are taken off the agents in the list,
+                   so that the schedules submitted with the same list do not overcommit them.
 
     """
     assert isinstance(sched, SchedulePlan)
 
-    agents = await self.get_agents()
-    plan = await self.__scheduler.schedule(sched, list(agents))
+    if agents is None:
+      agents = list(await self.get_agents())
+    # schedules are placed one at a time, each against the resources left by the others
+    async with self.__placement_lock:
+      plan = await self.__scheduler.schedule(sched, list(agents))
+      self._take_resources(agents, plan.containers)
     await multi([self.provision_volume(v) for v in plan.volumes])
     await multi([self.provision_container(c) for c in plan.containers])
 
   async def get_agents(self):
     return await self.__cluster_mgr.get_cluster(0)
 
+  def _take_resources(self, agents, contrs):
+    """
+    Replaces the agents hosting the containers in the list with copies left with the
+    remaining resources, as the agents themselves are shared with the cluster snapshot
+
+    :param agents: list of cluster.Agent
+    :param contrs: list of container.Container
+
+    """
+    demands = {}
+    for c in contrs:
+      host = c.sys_schedule_hints.placement.host
+      if not host:
+        continue
+      r, n = c.resources, c.instances if c.type == ContainerType.SERVICE else 1
+      demand = demands.setdefault(host, [0, 0, 0, 0])
+      for i, v in enumerate((r.cpus, r.mem, r.disk, r.gpu)):
+        demand[i] += v * n
+    for i, a in enumerate(agents):
+      if a.hostname not in demands:
+        continue
+      r, (cpus, mem, disk, gpus) = a.resources, demands[a.hostname]
+      agents[i] = Agent(a.id, a.hostname,
+                        AgentResources(**dict(r.to_save(), cpus=r.cpus - cpus, mem=r.mem - mem,
+                                              disk=r.disk - disk, gpus=r.gpus - gpus)),
+                        a.attributes)
+
   async def get_containers(self, **kwargs):
     status, contrs, err = await self.__contr_mgr.get_containers(**kwargs, full_blown=True)
     if status != 200:
@@ -67,8 +108,10 @@ class GlobalScheduleExecutor(Loggable, metaclass=Singleton):
   async def provision_container(self, contr):
     self.logger.info("Container '%s' is being provisioned"%contr.id)
     await self.__contr_mgr.save_container(contr)
-    status, contr, err = await self.__contr_mgr.get_container(contr.appliance, contr.id,
-                                                              full_blown=True)
+    status, contr, err = await self.__contr_mgr.hydrate_container(contr)
+    if err:
+      self.logger.error(err)
+      return
     status, contr, err = await self.__contr_mgr.provision_container(contr)
     if err:
       self.logger.error(err)
@@ -6,34 +6,72 @@ from tornado.httpserver import HTTPServer
 from appliance import Appliance
 from container import Container
 from volume import PersistentVolume
-from cluster.handler import ClusterInfoHandler
+from cluster.handler import ClusterInfoHandler, ClusterCapacityHandler
 from appliance.handler import AppliancesHandler, ApplianceHandler
 from appliance.ui.handler import ApplianceUIHandler
 from container.handler import ContainersHandler, ContainerHandler, ServicesHandler, JobsHandler
 from volume.handler import ApplianceVolumesHandler, ApplianceVolumeHandler, GlobalVolumeHandler
 from cluster.manager import ClusterManager
+from container.manager import ContainerManager
 from index.handler import IndexHandler
+from admin.handler import IndexStatsHandler
+from admin.manager import IndexManager
 from ping.handler import PingHandler
 from swagger.handler import SwaggerAPIHandler, SwaggerUIHandler
+from swagger import SwaggerAPIRegistry
+from commons import LeaderElection
 from config import config, get_global_scheduler
 from schedule.universal import GlobalScheduleExecutor
+from schedule.local import ApplianceScheduleExecutor
 from util import dirname
 
 
-def start_cluster_monitor():
-  tornado.ioloop.IOLoop.instance().add_callback(ClusterManager().start_monitor)
+def ensure_indexes():
+  tornado.ioloop.IOLoop.instance().add_callback(IndexManager().ensure_indexes)
 
 
-def start_global_scheduler():
+def start_leader_election():
+  """
+  Only the elected process monitors the cluster, subscribes to the Marathon events and
+  reschedules containers, while the others read the cluster info saved by the leader
+
+  """
+  cluster_mgr, contr_mgr = ClusterManager(), ContainerManager()
   scheduler = GlobalScheduleExecutor(get_global_scheduler())
-  tornado.ioloop.IOLoop.instance().add_callback(scheduler.start_rescheduler)
 
+  def on_elected():
+    cluster_mgr.start_monitor()
+    if config.marathon.event_stream:
+      contr_mgr.start_event_monitor()
+    scheduler.start_rescheduler()
 
-def start_server():
+  def on_demoted():
+    cluster_mgr.stop_monitor()
+    if config.marathon.event_stream:
+      contr_mgr.stop_event_monitor()
+    scheduler.stop_rescheduler()
+
+  election = LeaderElection('monitor', on_elected, on_demoted)
+  tornado.ioloop.IOLoop.instance().add_callback(election.start)
+
+
+def start_appliance_scheduler():
+  tornado.ioloop.IOLoop.instance().add_callback(ApplianceScheduleExecutor().start)
+
+
+def make_app():
+  """
+  Routes the handlers and registers their operations for the API specs
+
+  :return: tornado.web.Application
+
+  """
   app = Application([
     (r'\/*', IndexHandler),
     (r'/ping\/*', PingHandler),
     (r'/cluster\/*', ClusterInfoHandler),
+    (r'/cluster/capacity\/*', ClusterCapacityHandler),
+    (r'/admin/index\/*', IndexStatsHandler),
     (r'/appliance\/*', AppliancesHandler),
     (r'/appliance/(%s)\/*'%Appliance.ID_PATTERN, ApplianceHandler),
     (r'/appliance/(%s)/container\/*'%Appliance.ID_PATTERN, ContainersHandler),
@@ -50,14 +88,21 @@ def start_server():
     (r'/api', SwaggerAPIHandler),
     (r'/api/ui', SwaggerUIHandler),
   ])
+  SwaggerAPIRegistry().register_operations(app)
+  return app
+
+
+def start_server():
+  app = make_app()
   ssl_options = None
   if config.pivot.https:
     ssl_options = dict(certfile='/etc/pivot/server.pem', keyfile='/etc/pivot/server.key')
   server = tornado.httpserver.HTTPServer(app, ssl_options=ssl_options)
   server.bind(config.pivot.port)
   server.start(config.pivot.n_parallel)
-  start_cluster_monitor()
-  start_global_scheduler()
+  ensure_indexes()
+  start_leader_election()
+  start_appliance_scheduler()
   tornado.ioloop.IOLoop.instance().start()
 
 
@@ -1,4 +1,7 @@
+import json
+import gzip
 import yaml
+import hashlib
 import inspect
 import datetime
 import collections
@@ -103,15 +106,27 @@ class SwaggerAPIRegistry(Loggable, metaclass=Singleton):
     self.__enums = []
     self.__properties = collections.defaultdict(list)
     self.__specs = None
+    self.__payload = None
 
   def register_operations(self, app):
+    """
+    Registers the operations of the handlers routed by `app`. Handlers that have been
+    registered already are skipped, hence calling it repeatedly is harmless.
+
+    :param app: tornado.web.Application
+
+    """
     for r in app.wildcard_router.rules:
+      if r.target in self.__operations:
+        continue
       for name, member in inspect.getmembers(r.target):
         if hasattr(member, 'func_args'):
-          self.__handlers.append(r.target)
           path = r.matcher._path%tuple('{%s}'%a for a in member.func_args)
           ops = self.__operations.setdefault(r.target, dict(path=path, methods=[]))
           ops['methods'].append(member)
+      if r.target in self.__operations:
+        self.__handlers.append(r.target)
+        self.__specs = self.__payload = None
 
   def register_enum(self, enum):
     self.__enums.append(enum)
@@ -127,6 +142,18 @@ class SwaggerAPIRegistry(Loggable, metaclass=Singleton):
       self.__specs = self._generate_api_specs()
     return self.__specs
 
+  def get_api_specs_payload(self):
+    """
+    Serializes the API specs once and keeps the result for all the later requests
+
+    :return: tuple of the JSON bytes, its gzipped counterpart and the ETag of the former
+
+    """
+    if not self.__payload:
+      raw = json.dumps(self.get_api_specs()).encode('utf-8')
+      self.__payload = (raw, gzip.compress(raw), '"%s"'%hashlib.sha1(raw).hexdigest())
+    return self.__payload
+
   def _generate_api_specs(self):
     spec = dict(
       openapi='3.0.0',
@@ -1,4 +1,3 @@
-import json
 from tornado.web import RequestHandler
 
 from swagger import SwaggerAPIRegistry
@@ -11,10 +10,27 @@ class SwaggerUIHandler(RequestHandler):
 
 
 class SwaggerAPIHandler(RequestHandler):
+  """
+  Serves the API specs precomputed by the registry. The operations are registered once
+  at startup, see `server.make_app`.
+
+  """
 
   def initialize(self):
     self.__api_reg = SwaggerAPIRegistry()
-    self.__api_reg.register_operations(self.application)
+    self.__etag = None
 
   async def get(self):
-    self.write(json.dumps(self.__api_reg.get_api_specs()))
+    raw, gzipped, etag = self.__api_reg.get_api_specs_payload()
+    self.set_header('Content-Type', 'application/json; charset=UTF-8')
+    self.set_header('Vary', 'Accept-Encoding')
+    if 'gzip' in self.request.headers.get('Accept-Encoding', ''):
+      self.set_header('Content-Encoding', 'gzip')
+      self.__etag = '%s-gzip"'%etag[:-1]
+      self.write(gzipped)
+    else:
+      self.__etag = etag
+      self.write(raw)
+
+  def compute_etag(self):
+    return self.__etag
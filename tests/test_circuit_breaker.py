@@ -0,0 +1,55 @@
+import socket
+import asyncio
+import unittest
+
+from unittest import mock
+
+from commons import AsyncHttpClientWrapper, CircuitBreaker
+from config import HttpClientConfig
+
+
+class FailingClient:
+
+  def __init__(self, error):
+    self.error = error
+    self.n_fetches = 0
+
+  async def fetch(self, *args, **kwargs):
+    self.n_fetches += 1
+    raise self.error
+
+
+class CircuitBreakerTest(unittest.IsolatedAsyncioTestCase):
+
+  def setUp(self):
+    self.breaker = CircuitBreaker(threshold=1, timeout=0)
+    self.wrapper = AsyncHttpClientWrapper()
+    self.wrapper._get_circuit_breaker = lambda host, port: self.breaker
+    patcher = mock.patch.object(HttpClientConfig, 'max_retries', 0)
+    patcher.start()
+    self.addCleanup(patcher.stop)
+
+  async def fetch(self, error):
+    cli = FailingClient(error)
+    self.wrapper._AsyncHttpClientWrapper__cli = cli
+    try:
+      status, _, _ = await self.wrapper._fetch_raw('upstream', 80, 'http://upstream:80/', 'GET',
+                                                   None)
+    except BaseException:
+      status = None
+    return status, cli.n_fetches
+
+  async def test_probe_settled_on_any_error(self):
+    for error in (socket.gaierror(-2, 'Name or service not known'),
+                  OSError(113, 'No route to host'),
+                  ValueError('Unsupported URL scheme'),
+                  asyncio.CancelledError()):
+      self.breaker.record_failure()
+      self.assertTrue(self.breaker.is_open)
+      # the probe fails, and the next request is let through as a new probe
+      self.assertEqual(1, (await self.fetch(error))[1])
+      self.assertEqual(1, (await self.fetch(error))[1])
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,63 @@
+import datetime
+import unittest
+
+from unittest import mock
+
+from cluster import Agent, AgentResources
+from cluster.manager import ClusterManager
+
+
+class FakeAgentDB:
+
+  def __init__(self):
+    self.reads = 0
+
+  async def get_all_agents(self):
+    self.reads += 1
+    return [Agent('a1', '10.0.0.1', AgentResources(4, 8192, 1000, 0, ['1000-2000']), {})]
+
+
+class FakeSnapshotFile:
+
+  def load(self):
+    return None
+
+
+class FakeMonitor:
+
+  snapshot, is_live, last_update = None, False, None
+
+  async def discover_chronos(self):
+    pass
+
+  async def update(self):
+    pass
+
+
+class ClusterManagerSnapshotTest(unittest.IsolatedAsyncioTestCase):
+
+  def setUp(self):
+    self.mgr, self.db = ClusterManager(), FakeAgentDB()
+    for attr, val in (('agent_db', self.db), ('snapshot_file', FakeSnapshotFile()),
+                      ('cluster_monitor', FakeMonitor()), ('monitor_interval', 30000),
+                      ('db_snapshot', None), ('db_last_update', None), ('is_monitoring', False)):
+      patcher = mock.patch.object(self.mgr, '_ClusterManager__%s'%attr, val)
+      patcher.start()
+      self.addCleanup(patcher.stop)
+
+  def expire(self):
+    self.mgr._ClusterManager__db_last_update -= datetime.timedelta(seconds=31)
+
+  async def test_db_snapshot_expires_after_monitor_interval(self):
+    snapshot = await self.mgr.get_snapshot()
+    self.assertIs(snapshot, await self.mgr.get_snapshot())
+    self.assertEqual(1, self.db.reads)
+    self.expire()
+    self.assertIsNot(snapshot, await self.mgr.get_snapshot())
+    self.assertEqual(2, self.db.reads)
+
+  async def test_leader_caches_db_snapshot_before_first_update(self):
+    self.mgr._ClusterManager__is_monitoring = True
+    for _ in range(3):
+      self.assertEqual(['a1'], [a.id for a in (await self.mgr.get_snapshot()).agents])
+    self.assertEqual(1, self.db.reads)
@@ -0,0 +1,70 @@
+import json
+import unittest
+
+from cluster.manager import ClusterStreamMonitor
+
+
+def record(event):
+  data = json.dumps(event).encode('utf-8')
+  return b'%d\n%s'%(len(data), data)
+
+
+class ClusterStreamMonitorTest(unittest.IsolatedAsyncioTestCase):
+
+  AGENT = {
+    'agent_info': {
+      'id': {'value': 'agent-1'},
+      'hostname': '10.0.0.1',
+      'attributes': [{'name': 'zone', 'type': 'TEXT', 'text': {'value': 'us-east-1a'}}],
+      'resources': [],
+    },
+    'total_resources': [{'name': 'cpus', 'type': 'SCALAR', 'scalar': {'value': 4}},
+                        {'name': 'mem', 'type': 'SCALAR', 'scalar': {'value': 8192}}],
+  }
+
+  TASK = {
+    'name': 'web',
+    'task_id': {'value': 'web.1'},
+    'framework_id': {'value': 'marathon'},
+    'agent_id': {'value': 'agent-1'},
+    'state': 'TASK_RUNNING',
+    'resources': [{'name': 'cpus', 'type': 'SCALAR', 'scalar': {'value': 1}},
+                  {'name': 'mem', 'type': 'SCALAR', 'scalar': {'value': 1024}}],
+  }
+
+  def setUp(self):
+    self.monitor = ClusterStreamMonitor()
+    self.published = []
+
+    async def apply_agents(agents):
+      self.published.append({a.id: a for a in agents})
+
+    self.monitor._apply_agents = apply_agents
+
+  async def feed(self, *events):
+    self.monitor._on_chunk(None, b''.join(record(e) for e in events))
+    await self.monitor._publish()
+    return self.published[-1]
+
+  async def test_task_updated(self):
+    agents = await self.feed({'type': 'SUBSCRIBED',
+                              'subscribed': {'get_state': {'get_agents': {'agents': [self.AGENT]},
+                                                           'get_tasks': {'tasks': [self.TASK]}}}})
+    self.assertEqual(3, agents['agent-1'].resources.cpus)
+    # as sent by the Mesos master, the ids are only carried by the status of the task
+    agents = await self.feed({
+      'type': 'TASK_UPDATED',
+      'task_updated': {
+        'framework_id': {'value': 'marathon'},
+        'state': 'TASK_FINISHED',
+        'status': {'task_id': {'value': 'web.1'}, 'state': 'TASK_FINISHED',
+                   'agent_id': {'value': 'agent-1'}, 'source': 'SOURCE_EXECUTOR',
+                   'timestamp': 1500000000.0},
+      },
+    })
+    self.assertEqual(4, agents['agent-1'].resources.cpus)
+    self.assertEqual(8192, agents['agent-1'].resources.mem)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+
+from tornado.gen import multi
+
+# imported in the same order as by the server, as the managers import each other
+import appliance.manager
+
+from cluster import Agent, AgentResources
+from container import Container
+from schedule import SchedulePlan
+from schedule.universal import GlobalScheduleExecutor
+from schedule.plugin.universal.bin_packing import BinPackingGlobalScheduler
+
+
+class GlobalScheduleExecutorTest(unittest.IsolatedAsyncioTestCase):
+
+  def setUp(self):
+    self.executor = GlobalScheduleExecutor(BinPackingGlobalScheduler())
+    self.provisioned = []
+
+    async def provision_container(contr):
+      self.provisioned.append(contr)
+
+    async def provision_volume(vol):
+      pass
+
+    self.executor.provision_container = provision_container
+    self.executor.provision_volume = provision_volume
+
+  def make_plan(self, app_id, cpus, mem):
+    _, contr, _ = Container.parse(dict(id='c', appliance=app_id, type='job', image='busybox',
+                                       resources=dict(cpus=cpus, mem=mem)))
+    contr.sys_schedule_hints = contr.user_schedule_hints
+    plan = SchedulePlan()
+    plan.add_containers([contr])
+    return plan
+
+  async def test_batch_does_not_overcommit(self):
+    agents = [Agent('a1', '10.0.0.1', AgentResources(4, 8192, 1000, 0, ['1000-2000']),
+                    dict(preemptible='false')),
+              Agent('a2', '10.0.0.2', AgentResources(2, 4096, 1000, 0, ['1000-2000']),
+                    dict(preemptible='false'))]
+    snapshot = list(agents)
+    # as in a tick of the appliance scheduler, the same list is shared by the whole batch
+    await multi([self.executor.submit(self.make_plan('app-%d'%i, 2, 2048), agents)
+                 for i in range(4)])
+    hosts = [c.sys_schedule_hints.placement.host for c in self.provisioned]
+    self.assertEqual(4, len(hosts))
+    self.assertEqual(2, hosts.count('10.0.0.1'))
+    self.assertEqual(1, hosts.count('10.0.0.2'))
+    self.assertEqual(1, hosts.count(None))
+    self.assertEqual((0, 4096), (agents[0].resources.cpus, agents[0].resources.mem))
+    self.assertEqual((0, 2048), (agents[1].resources.cpus, agents[1].resources.mem))
+    # the agents of the cluster snapshot are left untouched
+    self.assertEqual(4, snapshot[0].resources.cpus)
+
+
+if __name__ == '__main__':
+  unittest.main()
@@ -0,0 +1,35 @@
+import json
+import unittest
+
+# imported in the same order as by the server, as the managers import each other
+import appliance.manager
+
+from container.manager import ServiceEventMonitor
+
+
+class ServiceEventMonitorTest(unittest.IsolatedAsyncioTestCase):
+
+  def setUp(self):
+    self.monitor = ServiceEventMonitor()
+    self.events = []
+    self.monitor._on_event = self.events.append
+
+    async def save_status():
+      pass
+
+    self.monitor._save_status = save_status
+
+  async def test_split_chunks(self):
+    data = json.dumps({'appId': '/app/web', 'message': 'café — ok'}, ensure_ascii=False)
+    raw = ('event: status_update_event\r\ndata: %s\r\n\r\n'%data).encode('utf-8') * 2
+    # every split point, including those within a multibyte character or a CRLF
+    for i in range(1, len(raw)):
+      self.monitor._ServiceEventMonitor__buf = b''
+      del self.events[:]
+      self.monitor._on_chunk(None, raw[:i])
+      self.monitor._on_chunk(None, raw[i:])
+      self.assertEqual(['event: status_update_event\ndata: %s'%data] * 2, self.events)
+
+
+if __name__ == '__main__':
+  unittest.main()
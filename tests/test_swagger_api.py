@@ -0,0 +1,59 @@
+import gc
+import sys
+import gzip
+import asyncio
+import json
+import unittest
+
+from tornado.httpclient import AsyncHTTPClient
+from tornado.httpserver import HTTPServer
+from tornado.testing import bind_unused_port
+
+import server
+
+
+class SwaggerAPIHandlerTest(unittest.IsolatedAsyncioTestCase):
+
+  async def asyncSetUp(self):
+    # the debug mode of the test loop would slow down the thousands of requests
+    asyncio.get_running_loop().set_debug(False)
+    sock, port = bind_unused_port()
+    self.server = HTTPServer(server.make_app())
+    self.server.add_sockets([sock])
+    self.url = 'http://127.0.0.1:%d/api'%port
+    self.cli = AsyncHTTPClient(force_instance=True)
+
+  async def asyncTearDown(self):
+    self.cli.close()
+    self.server.stop()
+
+  async def fetch(self, **kwargs):
+    return await self.cli.fetch(self.url, raise_error=False, **kwargs)
+
+  async def test_specs(self):
+    r = await self.fetch()
+    self.assertEqual(200, r.code)
+    specs = json.loads(r.body)
+    self.assertIn('/appliance/*', specs['paths'])
+    r_gz = await self.fetch(headers={'Accept-Encoding': 'gzip'}, decompress_response=False)
+    self.assertEqual('gzip', r_gz.headers.get('Content-Encoding'))
+    self.assertEqual(specs, json.loads(gzip.decompress(r_gz.body)))
+    for resp, headers in ((r, {}), (r_gz, {'Accept-Encoding': 'gzip'})):
+      r_cached = await self.fetch(headers=dict(headers, **{'If-None-Match': resp.headers['Etag']}))
+      self.assertEqual(304, r_cached.code)
+
+  async def test_memory_stays_flat(self):
+    for _ in range(200):
+      await self.fetch()
+    gc.collect()
+    n_blocks = sys.getallocatedblocks()
+    for _ in range(10000):
+      r = await self.fetch()
+      self.assertEqual(200, r.code)
+    gc.collect()
+    # i.e., less than a block per 10 requests, neither the registry nor the specs grow
+    self.assertLess(sys.getallocatedblocks() - n_blocks, 1000)
+
+
+if __name__ == '__main__':
+  unittest.main()
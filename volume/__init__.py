@@ -159,6 +159,9 @@ class PersistentVolume:
   REQUIRED = frozenset(['id'])
   ID_PATTERN = r'[a-zA-Z0-9-]+'
 
+  __slots__ = ('__id', '__scope', '__type', '__state', '__user_schedule_hints',
+               '__sys_schedule_hints', '__deployment', )
+
   @classmethod
   def parse(cls, data, from_user=True):
     if not isinstance(data, dict):
@@ -404,10 +407,12 @@ class VolumeDeployment:
 @swagger.model
 class GlobalPersistentVolume(PersistentVolume):
   
+  __slots__ = ('__used_by', )
+
   def __init__(self, used_by=[], *args, **kwargs):
     kwargs.update(scope=VolumeScope.GLOBAL)
     super(GlobalPersistentVolume, self).__init__(*args, **kwargs)
-    self.__used_by = set(used_by)
+    self.__used_by = frozenset(used_by)
     
   @property
   @swagger.property
@@ -419,21 +424,25 @@ class GlobalPersistentVolume(PersistentVolume):
     items: str
 
     """
-    return list(self.__used_by)
+    return tuple(self.__used_by)
 
   def subscribe(self, app_id):
-    self.__used_by.add(app_id)
+    self.__used_by |= {app_id}
 
   def unsubscribe(self, app_id):
-    self.__used_by.remove(app_id)
+    if app_id not in self.__used_by:
+      raise KeyError(app_id)
+    self.__used_by -= {app_id}
 
   def to_save(self):
-    return dict(**super(GlobalPersistentVolume, self).to_save(), used_by=self.used_by)
+    return dict(**super(GlobalPersistentVolume, self).to_save(), used_by=list(self.used_by))
   
 
 @swagger.model
 class LocalPersistentVolume(PersistentVolume):
   
+  __slots__ = ('__appliance', )
+
   def __init__(self, appliance, *args, **kwargs):
     kwargs.update(scope=VolumeScope.LOCAL)
     super(LocalPersistentVolume, self).__init__(*args, **kwargs)
@@ -1,6 +1,7 @@
 import appliance.manager
 
 from tornado.gen import multi
+from pymongo import ReplaceOne, IndexModel
 
 from config import config
 from commons import MongoClient
@@ -31,6 +32,7 @@ class VolumeManager(Manager):
     if status == 200:
       return 409, None, "Volume '%s' already exists"%vol.id
     await self.__vol_db.save_volume(vol)
+    self._invalidate_appliances(vol)
     return 201, vol, None
 
   async def update_volume(self, vol):
@@ -47,8 +49,21 @@ class VolumeManager(Manager):
     if status != 200:
       return status, None, "Failed to update persistent volume '%s'"%vol.id
     await self.__vol_db.save_volume(vol, False)
+    self._invalidate_appliances(vol)
     return status, "Persistent volume '%s' has been updated successfully"%vol.id, None
 
+  async def update_volumes(self, vols):
+    """
+    Saves existing volumes in a single bulk write
+
+    :param vols: list of volume.PersistentVolume
+
+    """
+    await self.__vol_db.save_volumes(vols, False)
+    for v in vols:
+      self._invalidate_appliances(v)
+    return 200, "%d persistent volume(s) have been updated successfully"%len(vols), None
+
   async def provision_volume(self, vol):
     """
 
@@ -62,6 +77,7 @@ class VolumeManager(Manager):
       return status, None, err
     vol.set_active()
     await self.__vol_db.save_volume(vol)
+    self._invalidate_appliances(vol)
     return status, vol, None
 
   async def deprovision_volume(self, vol):
@@ -81,6 +97,7 @@ class VolumeManager(Manager):
       return status, _, err
     vol.set_inactive()
     await self.__vol_db.save_volume(vol)
+    self._invalidate_appliances(vol)
     return status, "Persistent volume '%s' has been deprovisioned"%vol.id, None
 
   async def purge_global_volume(self, vol_id):
@@ -97,6 +114,7 @@ class VolumeManager(Manager):
     if status != 200:
       return status, None, err
     await self.__vol_db.delete_volume(vol)
+    self._invalidate_appliances(vol)
     return status, "Global persistent volume '%s' has been purged" % vol, None
 
   async def purge_local_volume(self, app_id, vol_id):
@@ -112,6 +130,7 @@ class VolumeManager(Manager):
     if status != 200:
       return status, None, err
     await self.__vol_db.delete_volume(vol)
+    self._invalidate_appliances(vol)
     return status, "Local persistent volume '%s' has been purged"%vol, None
 
   async def get_global_volume(self, vol_id):
@@ -129,14 +148,14 @@ class VolumeManager(Manager):
       _, vol.appliance, _ = await app_mgr.get_appliance(app_id)
     return status, vol, None
 
-  async def get_global_volumes_by_appliance(self, app_id):
-    return await self._get_volumes(VolumeScope.GLOBAL, used_by=app_id)
+  async def get_global_volumes_by_appliance(self, app_id, refresh=True):
+    return await self._get_volumes(VolumeScope.GLOBAL, refresh, used_by=app_id)
 
   async def get_global_volumes(self, **filters):
     return await self._get_volumes(VolumeScope.GLOBAL, **filters)
 
-  async def get_local_volumes(self, full_blown=False, **filters):
-    _, vols, _ = await self._get_volumes(VolumeScope.LOCAL, **filters)
+  async def get_local_volumes(self, full_blown=False, refresh=True, **filters):
+    _, vols, _ = await self._get_volumes(VolumeScope.LOCAL, refresh, **filters)
     if full_blown:
       app_mgr = appliance.manager.ApplianceManager()
       resps = await multi([app_mgr.get_appliance(v.appliance) for v in vols])
@@ -144,6 +163,15 @@ class VolumeManager(Manager):
         vols[i] = app
     return 200, vols, None
 
+  def _invalidate_appliances(self, vol):
+    app_mgr = appliance.manager.ApplianceManager()
+    if vol.scope == VolumeScope.LOCAL:
+      app_mgr.invalidate_appliance(vol.appliance if isinstance(vol.appliance, str)
+                                   else vol.appliance.id)
+    elif vol.scope == VolumeScope.GLOBAL:
+      for app_id in vol.used_by:
+        app_mgr.invalidate_appliance(app_id)
+
   async def _get_volume(self, db_get_vol_func, api_get_vol_func, *args):
     resps = await multi([db_get_vol_func(*args), api_get_vol_func(*args)])
     for i, (status, output, err) in enumerate(resps):
@@ -155,10 +183,12 @@ class VolumeManager(Manager):
         vol.deployment = VolumeDeployment(placement=Placement(**output['placement']))
     return status, vol, None
 
-  async def _get_volumes(self, scope, **filters):
+  async def _get_volumes(self, scope, refresh=True, **filters):
     assert isinstance(scope, VolumeScope)
     filters.update(scope=scope.value)
     vols = await self.__vol_db.get_volumes(**filters)
+    if not refresh:
+      return 200, vols, None
     resps = await multi([self.__vol_api.get_local_volume(v.appliance, v.id)
                          if scope == VolumeScope.LOCAL else self.__vol_api.get_global_volume(v.id)
                          for v in vols])
@@ -212,6 +242,11 @@ class VolumeDBManager(Manager):
   def __init__(self):
     self.__vol_col = MongoClient()[config.db.name].volume
 
+  async def ensure_indexes(self):
+    await self.__vol_col.create_indexes([IndexModel([('id', 1), ('appliance', 1)]),
+                                         IndexModel([('scope', 1), ('appliance', 1)]),
+                                         IndexModel([('scope', 1), ('used_by', 1)])])
+
   async def get_volumes(self, **filters):
     return [PersistentVolume.parse(v)[1] async for v in self.__vol_col.find(filters)]
 
@@ -222,10 +257,14 @@ class VolumeDBManager(Manager):
     return await self._get_volume(id=vol_id, appliance=app_id)
 
   async def save_volume(self, vol, upsert=True):
-    id = dict(id=vol.id)
-    if vol.scope == VolumeScope.LOCAL:
-      id.update(appliance=vol.appliance)
-    await self.__vol_col.replace_one(id, vol.to_save(), upsert=upsert)
+    await self.__vol_col.replace_one(self._get_volume_key(vol), vol.to_save(), upsert=upsert)
+
+  async def save_volumes(self, vols, upsert=True):
+    if not vols:
+      return
+    await self.__vol_col.bulk_write([ReplaceOne(self._get_volume_key(v), v.to_save(),
+                                                upsert=upsert)
+                                     for v in vols], ordered=False)
 
   async def delete_volume(self, vol):
     filters = dict(id=vol.id)
@@ -239,6 +278,12 @@ class VolumeDBManager(Manager):
     await self.__vol_col.delete_many(filters)
     return 200, "Containers matching '%s' have been deleted"%filters, None
 
+  def _get_volume_key(self, vol):
+    key = dict(id=vol.id)
+    if vol.scope == VolumeScope.LOCAL:
+      key.update(appliance=vol.appliance)
+    return key
+
   async def _get_volume(self, **filters):
     vol = await self.__vol_col.find_one(filters)
     if not vol: